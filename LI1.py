@@ -1,11 +1,56 @@
 # Import packages
-from psychopy import core, event, gui, visual, parallel, prefs
+import argparse
 import time
 import math
-import random
 import csv
 import os
-import cv2
+import threading
+import queue
+import collections
+import struct
+from array import array
+import atexit
+import json
+
+# Startup timing: every stage of startup (main thread and background device loader) is marked with its time since launch
+startup_start = time.perf_counter()
+startup_stages = [] # (stage, thread name, s since startup_start)
+
+def mark_stage(stage):
+    startup_stages.append((stage, threading.current_thread().name, time.perf_counter() - startup_start))
+
+from schedule import Schedule, assign_group, compile_schedule, load_schedule, load_schedule_cache, response_fields
+
+# Command line options, all optional: running with none behaves as before (prompts for PID and block order)
+parser = argparse.ArgumentParser(description="LI1 experiment")
+parser.add_argument("--headless", action="store_true",
+                    help="run on a virtual clock with a stub window, simulated port and webcam and a synthetic participant")
+parser.add_argument("--pid", help="participant ID, skips the prompt")
+parser.add_argument("--block-order", type=int, nargs="+", help="block order, skips the prompt")
+parser.add_argument("--data-folder", help="folder to save data in (default: the data folder next to this script)")
+parser.add_argument("--seed", type=int, help="headless only: seed for the synthetic participant's responses")
+parser.add_argument("--frame-rate", type=float, help="headless only: virtual refresh rate (lower runs faster)")
+parser.add_argument("--telemetry-port", type=int,
+                    help="stream live session events to experimenter consoles (watch_session.py) on this localhost port")
+parser.add_argument("--record-webcam", action="store_true",
+                    help="record the participant webcam to <PID>_webcam_<datetime>.mp4 with a per-frame timestamp index")
+parser.add_argument("--resume", action="store_true",
+                    help="continue the participant's session after the last trial in their checkpoint file")
+args = parser.parse_args()
+
+# only what the first screens need is imported here; cv2 is imported by the background device loader
+# and psychopy.parallel only when the ports are live
+cv2 = None
+if args.headless:
+    import headless
+    headless.configure(seed = args.seed, rate = args.frame_rate)
+    from headless import core, gui, visual, prefs, keyboard, GL, Image
+else:
+    from psychopy import core, gui, visual, prefs
+    from psychopy.hardware import keyboard
+    import pyglet.gl as GL
+    from PIL import Image
+mark_stage("import psychopy")
 
 ports_live = None # Set to None if parallel ports not plugged for coding/debugging other parts of exp
 
@@ -40,6 +85,8 @@ text_height = 30
 
 video_painratings_mean = {"TENS" : 81, "control": 31}
 video_painratings_spread = {"TENS" : 10, "control" : 10}
+video_painratings_seed = None # None = seed the social model's ratings from the PID, so each participant's session is reproducible
+video_painratings_match_block_means = False # shift each block's ratings so they average exactly video_painratings_mean
 video_painratings_buffer = 5
 video_stim_time = 60
 video_stim_iti = 6
@@ -52,23 +99,32 @@ webcam_stim_size = (400,300)
 #calculate iti_jitter
 # iti_jitter = [x * 1000 for x in iti_range]
 
+script_directory = os.path.dirname(os.path.abspath(__file__))  #Set the working directory to the folder the Python code is opened from
+
+# schedules precompiled by precompile_schedules.py, keyed by PID (empty if the cache file hasn't been built)
+schedule_cache = load_schedule_cache(os.path.join(script_directory, "schedules.json"))
+cached_participant = None
+checkpoint = None # the checkpoint being resumed from, if --resume
+
+def load_checkpoint(filepath):
+    try:
+        with open(filepath) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+
 # Participant info input
 while True:
     try:
-        P_info["PID"] = input("Enter participant ID: ")
+        P_info["PID"] = args.pid if args.pid is not None else input("Enter participant ID: ")
         if not P_info["PID"]:
             print("Participant ID cannot be empty.")
             continue
         
-        block_order = [int(block) for block in input("Enter block order: ").split()]
-        
-        print(block_order)
-            
         data_filename = P_info["PID"] + "_responses.csv"
-        script_directory = os.path.dirname(os.path.abspath(__file__))  #Set the working directory to the folder the Python code is opened from
         
         #set a path to a "data" folder to save data in
-        data_folder = os.path.join(script_directory, "data")
+        data_folder = args.data_folder if args.data_folder is not None else os.path.join(script_directory, "data")
         
         # if data folder doesn"t exist, create one
         if not os.path.exists(data_folder):
@@ -76,10 +132,39 @@ while True:
             
         #set file name within "data" folder
         data_filepath = os.path.join(data_folder,data_filename)
+        checkpoint_filepath = os.path.join(data_folder, P_info["PID"] + "_checkpoint.json")
         
-        if os.path.exists(data_filepath):
-            print(f"Data for participant {P_info['PID']} already exists. Choose a different participant ID.") ### to avoid re-writing existing data
+        if args.resume:
+            # the checkpoint carries the allocation and block order, so a resumed session can't be set up differently
+            checkpoint = load_checkpoint(checkpoint_filepath)
+            if checkpoint is None:
+                print(f"No checkpoint to resume participant {P_info['PID']} from.")
+                if args.pid is not None:
+                    raise SystemExit(1)
+                continue
+            group, cb, groupname = checkpoint["group"], checkpoint["cb"], checkpoint["groupname"]
+            block_order = checkpoint["block_order"]
+            print(f"Resuming participant {P_info['PID']} after trial {checkpoint['trialnum']}")
+            break
         
+        # an explicit --block-order always wins over the precompiled schedule cache
+        cached_participant = schedule_cache.get(P_info["PID"]) if args.block_order is None else None
+        if cached_participant is None and args.block_order is not None and P_info["PID"] in schedule_cache:
+            print(f"Ignoring the precompiled schedule for participant {P_info['PID']}: --block-order given")
+        if cached_participant is not None:
+            block_order = cached_participant["block_order"]
+            print(f"Loaded precompiled schedule for participant {P_info['PID']}")
+        elif args.block_order is not None:
+            block_order = args.block_order
+        else:
+            block_order = [int(block) for block in input("Enter block order: ").split()]
+        
+        print(block_order)
+        
+        if os.path.exists(data_filepath):
+            print(f"Data for participant {P_info['PID']} already exists. Choose a different participant ID, or use --resume to continue their session.") ### to avoid re-writing existing data
+            if args.pid is not None:
+                raise SystemExit(1) # can't choose again when the PID came from the command line
         
         # Group == 1 == pre-exposure
         # Group == 2 == social modelling
@@ -87,32 +172,14 @@ while True:
         # cb == 1 == TENS = GREEN, control = BLUE
         # cb == 2 == TENS = BLUE, control = GREEN
             
+        elif cached_participant is not None:
+            group = cached_participant["group"]
+            cb = cached_participant["cb"]
+            groupname = cached_participant["groupname"]
+            break
+        
         else:
-            if int(P_info["PID"]) % 6 == 1:
-                group = 1
-                cb = 1 
-                groupname = "socialmodel"
-            elif int(P_info["PID"]) % 6 == 2:
-                group = 2
-                cb = 1 
-                groupname = "preexposure"
-            elif int(P_info["PID"]) % 6 == 3:
-                group = 3
-                cb = 1 
-                groupname = "naturalhistory"
-            elif int(P_info["PID"]) % 6 == 4:
-                group = 1
-                cb = 2 
-                groupname = "socialmodel"
-            elif int(P_info["PID"]) % 6 == 5:
-                group = 2
-                cb = 2 
-                groupname = "preexposure"
-            elif int(P_info["PID"]) % 6 == 0:
-                group = 3
-                cb = 2
-                groupname = "naturalhistory"
-            
+            group, cb, groupname = assign_group(P_info["PID"])
             break  # Exit the loop if the participant ID is valid
         
     except KeyboardInterrupt:
@@ -138,12 +205,160 @@ stim_positions = {
     "control" : cue_positions[-cb]
 }
 
+# Live telemetry for experimenter consoles (telemetry.py, tail with watch_session.py), off unless --telemetry-port is given.
+# publish() never blocks, so it is safe in the render loop and the TENS pulse thread.
+telemetry = None
+if args.telemetry_port is not None:
+    from telemetry import TelemetryServer
+    telemetry = TelemetryServer(port = args.telemetry_port)
+    telemetry.start()
+    atexit.register(telemetry.stop)
+
+def publish(event, **fields):
+    if telemetry is not None:
+        telemetry.publish(event, **fields)
+
+publish("session", PID = P_info["PID"], groupname = groupname, block_order = block_order)
+
+# Parallel port driver: wraps parallel.ParallelPort (or simulates it when ports_live is None) so that writes of the
+# value already on the port are skipped, and every real transition is logged with its session time and write latency.
+# Safe to call from the TENS pulse thread and the render loop at once.
+class PortDriver:
+    def __init__(self, port = None):
+        self.port = port
+        self.value = None
+        self.lock = threading.Lock()
+        self.events = [] # (session time, value, write latency in s) for every transition since the last pop_events
+        self.writes_suppressed = 0
+
+    def setData(self, value):
+        with self.lock:
+            if value == self.value:
+                self.writes_suppressed += 1
+                return
+            write_start = time.perf_counter()
+            if self.port is not None:
+                self.port.setData(value)
+            write_latency = time.perf_counter() - write_start
+            self.value = value
+            self.events.append((core.monotonicClock.getTime(), value, write_latency))
+            publish("port", value = value, write_latency = write_latency)
+
+    def pop_events(self):
+        with self.lock:
+            events = self.events
+            self.events = []
+        return events
+
 if ports_live == True:
-    pport = parallel.ParallelPort(address=port_address) #Get from device Manager
-    pport.setData(0)
+    if args.headless:
+        from headless import parallel
+    else:
+        from psychopy import parallel
+    pport = PortDriver(parallel.ParallelPort(address=port_address)) #Get from device Manager
     
 elif ports_live == None:
-    pport = None #Get from device Manager
+    pport = PortDriver() # simulated port, logs transitions without writing anywhere
+pport.setData(0)
+
+# TENS pulse scheduler: a dedicated thread that drives pport.setData at exact TENS_pulse_int edges
+# (on for one interval, off for the next), so pulse timing no longer depends on the display frame rate.
+# Started and stopped by the trial code; every edge is logged with its intended and actual time, and written to
+# <PID>_tens_pulses.csv with its trial.
+pulse_spin_time = 0.001 # sleep until this close to an edge, then spin for sub-millisecond accuracy
+
+# Headless runs pass the virtual clock as `timer`: edges are then fired by its call_at timers as the clock advances,
+# instead of by a thread sleeping on the wall clock.
+class TENSPulser:
+    def __init__(self, pulse_interval, timer = None):
+        self.pulse_interval = pulse_interval
+        self.timer = timer
+        self.edge_log = [] # edges since the last pop_edges: trialnum, edge, port value, intended and actual time from pulse start in s
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.timer_run = 0 # bumped by stop so timers left over from a stopped run do nothing
+        self.timer_active = False
+        self.trial_edges = 0
+        self.trial_max_lag = 0
+
+    def start(self, stimulus, trialnum = None, eda_duration = 0):
+        # eda_duration: seconds from pulse start during which on-pulses also carry eda_trig to mark TENS onset
+        self.stop()
+        self.stop_event.clear()
+        self.trial_edges = 0
+        self.trial_max_lag = 0
+        if self.timer is not None:
+            self.timer_active = True
+            self.timer_edge(self.timer_run, stimulus, trialnum, eda_duration, self.timer.now, 0)
+            return
+        self.thread = threading.Thread(target=self.pulse_loop,
+                                       args=(stimulus, trialnum, eda_duration),
+                                       name="tens_pulser",
+                                       daemon=True)
+        self.thread.start()
+
+    def pulse_loop(self, stimulus, trialnum, eda_duration):
+        start_time = time.perf_counter()
+        edge = 0
+        while True:
+            intended = start_time + edge * self.pulse_interval
+            remaining = intended - time.perf_counter()
+            if remaining > pulse_spin_time and self.stop_event.wait(remaining - pulse_spin_time):
+                break
+            while time.perf_counter() < intended:
+                pass
+            if self.stop_event.is_set():
+                break
+            
+            self.write_edge(stimulus, trialnum, eda_duration, edge, start_time, intended, time.perf_counter)
+            edge += 1
+
+    def timer_edge(self, run, stimulus, trialnum, eda_duration, start_time, edge):
+        if run != self.timer_run:
+            return
+        intended = start_time + edge * self.pulse_interval
+        self.write_edge(stimulus, trialnum, eda_duration, edge, start_time, intended, lambda: self.timer.now)
+        self.timer.call_at(intended + self.pulse_interval,
+                           lambda: self.timer_edge(run, stimulus, trialnum, eda_duration, start_time, edge + 1))
+
+    def write_edge(self, stimulus, trialnum, eda_duration, edge, start_time, intended, clock):
+        if edge % 2 == 0:
+            value = tens_trig[stimulus] + (eda_trig if edge * self.pulse_interval < eda_duration else 0)
+        else:
+            value = 0
+        pport.setData(value)
+        actual = clock()
+        
+        self.edge_log.append({"trialnum": trialnum, "edge": edge, "value": value,
+                              "intended_time": intended - start_time, "actual_time": actual - start_time})
+        self.trial_edges += 1
+        self.trial_max_lag = max(self.trial_max_lag, actual - intended)
+
+    def stop(self):
+        if self.timer_active:
+            self.timer_run += 1
+            self.timer_active = False
+            pport.setData(0)
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        pport.setData(0)
+
+    def pop_trial_stats(self):
+        # edges delivered and worst lag behind the intended edge time since the last call
+        stats = (self.trial_edges, self.trial_max_lag)
+        self.trial_edges = 0
+        self.trial_max_lag = 0
+        return stats
+
+    def pop_edges(self):
+        edges = self.edge_log
+        self.edge_log = []
+        return edges
+
+tens_pulser = TENSPulser(TENS_pulse_int, timer = headless.virtual_clock if args.headless else None)
 
 # set up screen
 win = visual.Window(
@@ -152,6 +367,86 @@ win = visual.Window(
     monitor="testMonitor", color=[0, 0, 0], colorSpace="rgb1",
     blendMode="avg", useFBO=True,
     units="pix")
+mark_stage("open window")
+
+# Input service: every key press read from psychopy's hardware keyboard goes through one queue with its timestamp.
+# With the psychtoolbox backend (which timestamps each press at hardware time, independent of window events) a
+# polling thread reads the keyboard. Otherwise Keyboard.getKeys falls back to window events, which must be
+# dispatched on the main thread, so the keyboard is polled there instead: every termination_check and get_press,
+# and between the short core.wait calls (which also keep the window's events pumped) in wait_for.
+# Escape also sets a flag, so termination_check stays a cheap check each frame.
+input_poll_interval = 0.001 # s between keyboard polls on the polling thread
+input_wait_interval = 0.005 # s per core.wait while wait_for waits on the main thread
+input_queue_size = 64 # most recent presses kept for get_press/wait_for, older ones are dropped
+
+class InputService:
+    def __init__(self):
+        self.keyboard = keyboard.Keyboard()
+        self.threaded = getattr(keyboard, "havePTB", False)
+        self.presses = collections.deque(maxlen=input_queue_size) # (key name, hardware timestamp)
+        self.lock = threading.Lock()
+        self.escape_pressed = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.keyboard.clearEvents()
+        if self.threaded:
+            self.thread = threading.Thread(target=self.poll_loop, name="input_service", daemon=True)
+            self.thread.start()
+
+    def poll(self):
+        keys = self.keyboard.getKeys(waitRelease=False)
+        if keys:
+            with self.lock:
+                for key in keys:
+                    if key.name == "escape":
+                        self.escape_pressed.set()
+                    self.presses.append((key.name, key.tDown))
+
+    def poll_main(self):
+        # poll from the main thread when there is no polling thread
+        if not self.threaded:
+            self.poll()
+
+    def poll_loop(self):
+        while True:
+            self.poll()
+            time.sleep(input_poll_interval)
+
+    def clear(self):
+        self.poll_main()
+        with self.lock:
+            self.presses.clear()
+        if not self.threaded:
+            self.keyboard.clearEvents() # empty after the poll above, but restarts the headless participant's response time
+
+    def pop_press(self, keyList):
+        # first queued press in keyList (any key if None), discarding the presses before it
+        if isinstance(keyList, str):
+            keyList = [keyList]
+        with self.lock:
+            while self.presses:
+                name, press_time = self.presses.popleft()
+                if keyList is None or name in keyList:
+                    return name, press_time
+        return None
+
+    def get_press(self, keyList = None):
+        # never blocks: None if no matching key has been pressed since the last call
+        self.poll_main()
+        return self.pop_press(keyList)
+
+    def wait_for(self, keyList = None):
+        # wait on the main thread until a matching key is pressed after this call, returning (key name, timestamp)
+        self.clear()
+        while True:
+            press = self.get_press(keyList)
+            if press is not None:
+                return press
+            core.wait(input_wait_interval)
+
+input_service = InputService()
+input_service.start()
 
 # fixation stimulus
 fix_stim = visual.TextStim(win,
@@ -161,215 +456,406 @@ fix_stim = visual.TextStim(win,
                             font = "Roboto Mono Medium")
 
 #create instruction trials
+# Instruction text stimuli are cached by text and layout, so each screen's TextStim is laid out once
+# (prebuilt for every instructions_text entry by warm_text_stims) and redrawn instantly afterwards
+text_stims = {}
+instruction_buttontext = "\n\nPress spacebar to continue"
+
+def get_text_stim(text, pos = (0,0), wrapWidth = 960, height = text_height):
+    key = (text, pos, wrapWidth, height)
+    if key not in text_stims:
+        text_stims[key] = visual.TextStim(win,
+                                          text = text,
+                                          height = height,
+                                          color = "white",
+                                          pos = pos,
+                                          wrapWidth = wrapWidth)
+    return text_stims[key]
+
+def warm_text_stims():
+    # build and draw (without flipping) every instruction screen so glyphs are rendered before they are needed
+    warmup_start = time.perf_counter()
+    stims = [get_text_stim(text) for text in instructions_text.values()]
+    stims.append(get_text_stim(instruction_buttontext, pos = (0,-400), wrapWidth = None))
+    stims += [get_text_stim(instructions_text[screen], wrapWidth = None) for screen in ("end", "termination")]
+    for stim in stims:
+        stim.draw()
+    win.clearBuffer()
+    print(f"Prebuilt {len(text_stims)} instruction text stimuli in {(time.perf_counter() - warmup_start)*1000:.0f} ms")
+
 def instruction_trial(instructions,
                       holdtime=0,
                       key = "space",
-                      buttontext = "\n\nPress spacebar to continue"): 
+                      buttontext = instruction_buttontext): 
     termination_check()
     
-    visual.TextStim(win,
-                    text = instructions,
-                    height = text_height,
-                    color = "white",
-                    pos = (0,0),
-                    wrapWidth= 960
-                    ).draw()
+    instruction_stim = get_text_stim(instructions)
+    instruction_stim.draw()
     win.flip()
     core.wait(holdtime)
-    visual.TextStim(win,
-                    text = instructions,
-                    height = text_height,
-                    color = "white",
-                    pos = (0,0),
-                    wrapWidth= 960
-                    ).draw()
-    
-    visual.TextStim(win,
-                    text = buttontext,
-                    height = text_height,
-                    color = "white",
-                    pos = (0,-400)
-                    ).draw()
+    instruction_stim.draw()
+    get_text_stim(buttontext, pos = (0,-400), wrapWidth = None).draw()
     win.flip()
-    event.waitKeys(keyList=key)
+    input_service.wait_for(key)
     win.flip()
     
     core.wait(2)
     
 # Create functions
-    # Save responses to a CSV file
-def save_data(data):
-    for trial in trial_order:
-        trial['datetime'] = datetime
-        trial['experimentcode'] = experimentcode
-        trial["PID"] = P_info["PID"]
-        trial["group"] = group
-        trial["groupname"] = groupname
-        trial["cb"] = cb
-        trial['blockorder'] = block_order
-        trial["tens_colour"] = stim_colour_names["TENS"]
-        trial["control_colour"] = stim_colour_names["control"]
-        
-
-    # Extract column names from the keys in the first trial dictionary
-    colnames = list(trial_order[0].keys())
-
-    # Open the CSV file for writing
-    with open(data_filepath, mode="w", newline="") as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=colnames)
-        
-        # Write the header row
+    # Save responses to a CSV file, one row appended per completed trial
+data_colnames = ["phase", "blocknum", "stimulus", "outcome", "trialname", "exp_response", "pain_response", "iti", "trialnum",
+                 "exp_first_rt", "exp_final_rt", "exp_adjustments", "pain_first_rt", "pain_final_rt", "pain_adjustments",
+                 "tens_pulse_edges", "tens_pulse_max_lag", "frame_mean", "frame_max", "frames_dropped",
+                 "datetime", "experimentcode", "PID", "group", "groupname", "cb", "blockorder", "tens_colour", "control_colour"]
+data_fsync = True # fsync after every row so a crash or escape press loses at most the trial in progress
+data_queue_size = 64 # max batches of rows waiting for the background writer before save_trial blocks
+data_outputs = {} # output name -> (open file, csv.DictWriter), all written by the background writer thread
+data_queue = queue.Queue(maxsize=data_queue_size)
+data_writer_thread = None
+data_records_queued = 0
+data_records_written = 0
+
+# Frame timing (opt-in): every flip in show_trial is logged with its trial, phase, segment and draw calls to <PID>_frames.csv
+record_frame_timing = False
+frame_colnames = ["trialnum", "phase", "segment", "flip_time", "frame_interval", "frames_dropped", "draw_calls"]
+frame_log = []
+
+# Port transitions logged by PortDriver, written to <PID>_port_events.csv along with each trial
+port_event_colnames = ["trialnum", "time", "value", "write_latency"]
+tens_pulse_colnames = ["trialnum", "edge", "value", "intended_time", "actual_time"]
+
+# Slider response traces: every change of the expectancy/pain rating is recorded with its time from slider onset.
+# Traces go to <PID>_slider_traces.bin, one little-endian record per slider per trial:
+#   uint32 trialnum, uint8 slider (0 = expectancy, 1 = pain), uint32 n, then n x (float64 time in s, float32 rating)
+slider_codes = {"expectancy": 0, "pain": 1}
+slider_traces = {} # slider name -> SliderTrace for the current trial
+
+class SliderTrace:
+    def __init__(self, trialnum, slider_name, onset):
+        self.trialnum = trialnum
+        self.slider_name = slider_name
+        self.onset = onset
+        self.times = array("d")
+        self.ratings = array("f")
+        self.last_rating = None
+
+    def sample(self, rating, sample_time):
+        # cheap enough for every frame: one comparison unless the marker moved
+        if rating is not None and rating != self.last_rating:
+            self.times.append(sample_time - self.onset)
+            self.ratings.append(rating)
+            self.last_rating = rating
+
+    def pack(self):
+        record = struct.pack("<IBI", self.trialnum, slider_codes[self.slider_name], len(self.times))
+        return record + b"".join(struct.pack("<df", sample_time, rating) for sample_time, rating in zip(self.times, self.ratings))
+
+class TraceWriter:
+    def __init__(self, output_file):
+        self.output_file = output_file
+
+    def writerows(self, traces):
+        for trace in traces:
+            self.output_file.write(trace.pack())
+
+def stamp_trial(trial):
+    trial['datetime'] = datetime
+    trial['experimentcode'] = experimentcode
+    trial["PID"] = P_info["PID"]
+    trial["group"] = group
+    trial["groupname"] = groupname
+    trial["cb"] = cb
+    trial['blockorder'] = block_order
+    trial["tens_colour"] = stim_colour_names["TENS"]
+    trial["control_colour"] = stim_colour_names["control"]
+
+def flush_data_file(output_file):
+    if output_file is None:
+        return
+    output_file.flush()
+    if data_fsync:
+        os.fsync(output_file.fileno())
+
+def data_writer_loop():
+    # runs on the background writer thread: serialise and write queued rows until the None sentinel arrives
+    global data_records_written
+    while True:
+        item = data_queue.get()
+        try:
+            if item is None:
+                break
+            name, rows = item
+            output_file, writer = data_outputs[name]
+            writer.writerows(rows)
+            flush_data_file(output_file)
+            data_records_written += len(rows)
+        except (OSError, ValueError) as error:
+            print(f"Failed to write {name} data: {error}")
+        finally:
+            data_queue.task_done()
+
+def open_data_output(name, filepath, colnames, append = False):
+    # Open a CSV file for writing and write the header row once (appending to a resumed session's file instead)
+    append = append and os.path.exists(filepath) and os.path.getsize(filepath) > 0
+    output_file = open(filepath, mode="a" if append else "w", newline="")
+    writer = csv.DictWriter(output_file, fieldnames=colnames, extrasaction="ignore")
+    if not append:
         writer.writeheader()
-        
-        # Write each trial"s data to the CSV file
-        for trial in data:
-            writer.writerow(trial)
+    flush_data_file(output_file)
+    data_outputs[name] = (output_file, writer)
+
+def open_trace_output(name, filepath, append = False):
+    output_file = open(filepath, mode="ab" if append else "wb")
+    data_outputs[name] = (output_file, TraceWriter(output_file))
+
+# Checkpoint: after every trial the writer thread replaces <PID>_checkpoint.json with the number of the last completed
+# trial, its phase, lastblocknum, the responses so far and the synthetic participant's RNG state (headless only;
+# everything random in a real session is fixed in <PID>_schedule.json). Queued after the trial's rows, so the
+# checkpoint never runs ahead of the data. `python LI1.py --resume` restarts from it.
+checkpoint_responses = {} # trialnum -> response fields of every completed trial
+
+class CheckpointWriter:
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def writerows(self, checkpoints):
+        # write to a temporary file and swap it in, so a crash mid-write leaves the previous checkpoint intact
+        temp_filepath = self.filepath + ".tmp"
+        with open(temp_filepath, mode="w") as checkpoint_file:
+            json.dump(checkpoints[-1], checkpoint_file)
+            flush_data_file(checkpoint_file)
+        os.replace(temp_filepath, self.filepath)
+
+def save_checkpoint(trial):
+    checkpoint_responses[str(trial["trialnum"])] = {field: trial[field] for field in response_fields}
+    queue_rows("checkpoint", [{"trialnum": trial["trialnum"],
+                               "phase": trial["phase"],
+                               "lastblocknum": lastblocknum,
+                               "group": group,
+                               "cb": cb,
+                               "groupname": groupname,
+                               "block_order": block_order,
+                               "rng_state": headless.responder.getstate() if args.headless else None,
+                               "responses": dict(checkpoint_responses)}])
+
+# A crash can land after a trial's rows are on disk but before its checkpoint is, so before a resumed session appends,
+# every output is cut back to the trials the checkpoint covers
+def truncate_csv(filepath, last_trialnum):
+    if not os.path.exists(filepath):
+        return
+    with open(filepath, newline="") as csv_file:
+        rows = list(csv.reader(csv_file))
+    if not rows:
+        return
+    trialnum_index = rows[0].index("trialnum")
+    kept = [rows[0]] + [row for row in rows[1:] if len(row) > trialnum_index and row[trialnum_index].isdigit()
+                        and int(row[trialnum_index]) <= last_trialnum]
+    if len(kept) < len(rows):
+        with open(filepath + ".tmp", mode="w", newline="") as csv_file:
+            csv.writer(csv_file).writerows(kept)
+        os.replace(filepath + ".tmp", filepath)
+        print(f"Removed {len(rows) - len(kept)} rows after trial {last_trialnum} from {os.path.basename(filepath)}")
+
+def truncate_traces(filepath, last_trialnum):
+    # keep whole SliderTrace records up to last_trialnum (a record cut short by the crash is dropped too)
+    if not os.path.exists(filepath):
+        return
+    with open(filepath, mode="rb") as trace_file:
+        data = trace_file.read()
+    end = 0
+    while end + 9 <= len(data):
+        trialnum, slider_code, num_samples = struct.unpack_from("<IBI", data, end)
+        record_end = end + 9 + num_samples * 12
+        if trialnum > last_trialnum or record_end > len(data):
+            break
+        end = record_end
+    if end < len(data):
+        with open(filepath + ".tmp", mode="wb") as trace_file:
+            trace_file.write(data[:end])
+        os.replace(filepath + ".tmp", filepath)
+
+def truncate_to_checkpoint(last_trialnum):
+    for name in ("responses", "port_events", "frames", "tens_pulses"):
+        filepath = data_filepath if name == "responses" else os.path.join(data_folder, P_info["PID"] + "_" + name + ".csv")
+        truncate_csv(filepath, last_trialnum)
+    truncate_traces(os.path.join(data_folder, P_info["PID"] + "_slider_traces.bin"), last_trialnum)
+
+def open_data_file(append = False):
+    global data_writer_thread
+    open_data_output("trials", data_filepath, data_colnames, append)
+    open_trace_output("slider_traces", os.path.join(data_folder, P_info["PID"] + "_slider_traces.bin"), append)
+    open_data_output("port_events", os.path.join(data_folder, P_info["PID"] + "_port_events.csv"), port_event_colnames, append)
+    open_data_output("tens_pulses", os.path.join(data_folder, P_info["PID"] + "_tens_pulses.csv"), tens_pulse_colnames, append)
+    if record_frame_timing:
+        open_data_output("frames", os.path.join(data_folder, P_info["PID"] + "_frames.csv"), frame_colnames, append)
+    data_outputs["checkpoint"] = (None, CheckpointWriter(checkpoint_filepath))
+    
+    data_writer_thread = threading.Thread(target=data_writer_loop, name="data_writer", daemon=True)
+    data_writer_thread.start()
+    atexit.register(drain_data_writer)
+
+def queue_rows(name, rows):
+    # Hand rows to the writer thread so disk I/O never lands on the render loop
+    global data_records_queued
+    if data_writer_thread is None or name not in data_outputs:
+        return
+    data_queue.put((name, rows))
+    data_records_queued += len(rows)
+
+published_phase = None
+
+def publish_trial_start(trial):
+    global published_phase
+    if trial["phase"] != published_phase:
+        published_phase = trial["phase"]
+        publish("phase", phase = published_phase)
+    publish("trial_start", trialnum = trial["trialnum"], trialname = trial["trialname"], blocknum = trial["blocknum"])
+
+last_saved_trialnum = None
+
+def queue_port_events(trialnum):
+    # port transitions since the last call, tagged with the trial they belong to (the latest saved one after the last trial)
+    global last_saved_trialnum
+    last_saved_trialnum = trialnum
+    queue_rows("port_events", [{"trialnum": trialnum, "time": event_time, "value": value, "write_latency": write_latency}
+                               for event_time, value, write_latency in pport.pop_events()])
+
+def save_trial(trial):
+    # Queue a snapshot of the completed trial (and its frame, port and slider logs) for the writer thread
+    stamp_trial(trial)
+    publish("trial_end", **{field: trial.get(field) for field in ("trialnum", "exp_response", "pain_response", "frame_mean",
+                                                                  "frame_max", "frames_dropped", "tens_pulse_max_lag")})
+    queue_rows("trials", [dict(trial)])
+    queue_port_events(trial["trialnum"])
+    queue_rows("tens_pulses", tens_pulser.pop_edges())
+    if frame_log:
+        queue_rows("frames", list(frame_log))
+        frame_log.clear()
+    if slider_traces:
+        queue_rows("slider_traces", list(slider_traces.values()))
+        slider_traces.clear()
+
+def log_frame(current_trial, segment, flip_time, last_flip, frame_period, draw_calls):
+    interval = flip_time - last_flip if last_flip is not None else None
+    frame_log.append({"trialnum": current_trial["trialnum"],
+                      "phase": current_trial["phase"],
+                      "segment": segment,
+                      "flip_time": flip_time,
+                      "frame_interval": interval,
+                      "frames_dropped": max(0, round(interval / frame_period) - 1) if interval is not None else 0,
+                      "draw_calls": draw_calls})
+
+def summarise_frames(current_trial):
+    # per-trial frame time summary columns from the frames logged so far this trial
+    intervals = [frame["frame_interval"] for frame in frame_log if frame["frame_interval"] is not None]
+    if intervals:
+        current_trial["frame_mean"] = sum(intervals) / len(intervals)
+        current_trial["frame_max"] = max(intervals)
+        current_trial["frames_dropped"] = sum(frame["frames_dropped"] for frame in frame_log)
+
+def build_render_list(stims):
+    # each stimulus once, in first-listed order
+    render_list = []
+    for stim in stims:
+        if stim is not None and not any(stim is listed for listed in render_list):
+            render_list.append(stim)
+    return render_list
+
+def trace_slider(current_trial, slider_name, flip_time):
+    if slider_name not in slider_traces:
+        slider_traces[slider_name] = SliderTrace(current_trial["trialnum"], slider_name, flip_time)
+    slider_traces[slider_name].sample(rating_stim[slider_name].getRating(), flip_time)
+
+def summarise_slider_traces(current_trial):
+    # first-touch RT, final RT and number of adjustments after the first touch, per slider
+    for slider_name, prefix in (("expectancy", "exp"), ("pain", "pain")):
+        trace = slider_traces.get(slider_name)
+        if trace is not None and trace.times:
+            current_trial[prefix + "_first_rt"] = trace.times[0]
+            current_trial[prefix + "_final_rt"] = trace.times[-1]
+            current_trial[prefix + "_adjustments"] = len(trace.times) - 1
+
+def close_data_file():
+    for output_file, writer in data_outputs.values():
+        if output_file is None:
+            continue
+        flush_data_file(output_file)
+        output_file.close()
+    data_outputs.clear()
+
+def drain_data_writer():
+    # Wait for every queued row to reach disk, then stop the writer thread and close the files. Safe to call more than once.
+    global data_writer_thread
+    if data_writer_thread is None:
+        return
+    queue_port_events(last_saved_trialnum) # the closing setData(0) and anything else after the last saved trial
+    data_queue.put(None)
+    data_writer_thread.join()
+    data_writer_thread = None
+    close_data_file()
+    print(f"Data records queued: {data_records_queued}, written: {data_records_written}")
     
 def exit_screen(instructions):
+    drain_data_writer()
     win.flip()
-    visual.TextStim(win,
-            text = instructions,
-            height = text_height,
-            color = "white",
-            pos = (0,0)).draw()
+    get_text_stim(instructions, wrapWidth = None).draw()
     win.flip()
-    event.waitKeys()
+    input_service.wait_for()
     win.close()
     
 def termination_check(): #insert throughout experiment so participants can end at any point.
-    keys_pressed = event.getKeys(keyList=["escape"])  # Check for "escape" key during countdown
-    if "escape" in keys_pressed:
-        if ports_live:
-            pport.setData(0) # Set all pins to 0 to shut off context, TENS, shock etc.
-        # Save participant information
-
-        save_data(trial_order)
+    input_service.poll_main()
+    if input_service.escape_pressed.is_set():  # Check for "escape" key (set by the input service)
+        tens_pulser.stop()
+        pport.setData(0) # Set all pins to 0 to shut off context, TENS, shock etc.
+        # Save participant information (flush any trials still queued for the writer)
+        drain_data_writer()
         exit_screen(instructions_text["termination"])
         core.quit()
 
 
-# Define trials
-trial_order = []
-
-# familiarisation trials
-num_familiarisation = 15
-
-for i in range(1, num_familiarisation + 1):
-    trial = {
-        "phase": "familiarisation",
-        "blocknum": None,
-        "stimulus": None,
-        "outcome": None,
-        "trialname": "familiarisation",
-        "exp_response": None,
-        "pain_response": None,
-        "iti" : None
-    } 
-    trial_order.append(trial)
-
-
-#pre-exposure trials
-num_TENS_preexp = 16
-
-for i in range(1, num_TENS_preexp + 1):
-    trial = {
-        "phase": "preexposure",
-        "blocknum": None,
-        "stimulus": "TENS",
-        "outcome": "none",
-        "trialname": "preexposure",
-        "exp_response": None,
-        "pain_response": None,
-        "iti" : None
-    } 
-    trial_order.append(trial)
-
-
-#### 4 x blocks (4x fixed pseudo-randomised runs of 4x TENs and 4x no-TENS)
-num_blocks_conditioning = 2
-num_blocks_extinction = 2
-
-socialmodel_stim_blocks = [['control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'TENS', 'control','control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control'],
-                           ['TENS', 'TENS', 'TENS', 'control', 'TENS', 'control', 'TENS', 'control','control', 'TENS', 'control', 'TENS', 'control', 'control', 'TENS', 'control']]
-
-socialmodel_outcome_blocks = [['low','high','low','low','high','high','high','low','low','high','high','low','low','high','high','low'],
-                              ['high','high','high','low','high','low','high','low','low','high','low','high','low','low','high','low']]
-
-extinction_stim_blocks = [['control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'TENS', 'control'],
-                            ['control', 'TENS', 'control', 'TENS', 'control', 'control', 'TENS', 'control', 'TENS', 'TENS', 'TENS', 'control', 'TENS', 'control', 'TENS', 'control'],
-                            ['TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'control', 'TENS'],
-                            ['TENS', 'control', 'TENS', 'control', 'TENS', 'TENS', 'control', 'TENS', 'control', 'control', 'control', 'TENS', 'control', 'TENS', 'control', 'TENS']]
-
-#natural history has non-contingent pairings between high-low outcomes and stimuli, so we'll change the stimuli block 
-# and keep the outcome blocks the same since the outcome order is pre-programmed on the CHEPS
-naturalhistory_stim_blocks = [['TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control'],
-                              ['TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control'],
-                              ['control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS'],
-                              ['control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS']]
-
-##need a different list to allocate high and low heat outcomes to TENS/control trials 
-#0 = TENS high, 1 = TENS low, 2 = control high, 3 = control low
-#conditioning pairs TENS with high outcome (nocebo), and control with low outcome
-naturalhistory_outcome_blocks = [['low','high','high','low','low','high','high','low','low','high','low','low','high','high','high','low'],
-                               ['low','high','low','high','low','low','high','low','high','high','high','low','high','low','high','low'],
-                               ['low','low','high','high','high','low','low','high','high','low','high','high','low','low','low','high'],
-                               ['high','low','high','low','low','high','low','high','low','low','high','high','low','high','low','high']]
-
-#low heat for every trial in extinction regardless of stimulus
-extinction_outcome_block = ['low']*16
-
-### create list of trials based on trial_block order, iterating through stimulus + outcome blocks in parallel
-    #create conditioning blocks, outcome dependent on natural history vs nocebo conditioning contingencies
-if groupname != "naturalhistory": 
-    for block in range(1,num_blocks_conditioning+1):
-        for stimulus,outcome in zip(socialmodel_stim_blocks[block-1],socialmodel_outcome_blocks[block-1]):
-            trial = {
-                "phase": "conditioning",
-                "blocknum": block,
-                "stimulus": stimulus,
-                "outcome": outcome,
-                "trialname": str(stimulus) + "_" + str(outcome),
-                "exp_response": None,
-                "pain_response": None,
-                "iti" : None
-            }
-            trial_order.append(trial)
-            
-elif groupname == "naturalhistory":
-    for block in range(1,num_blocks_conditioning+1):
-        for stimulus,outcome in zip(naturalhistory_stim_blocks[block_order[block-1]],naturalhistory_outcome_blocks[block_order[block-1]]):
-            trial = {
-                "phase": "conditioning",
-                "blocknum": block,
-                "stimulus": stimulus,
-                "outcome": outcome,
-                "trialname": str(stimulus) + "_" + str(outcome),
-                "exp_response": None,
-                "pain_response": None,
-                "iti": None
-            }
-            trial_order.append(trial)
-                    
-#create extinction trials, all outcomes same regardless of condition (low heat)
-for block in range(num_blocks_conditioning+1,num_blocks_conditioning+num_blocks_extinction+1):
-    for stimulus,outcome in zip(extinction_stim_blocks[block_order[block-1]],extinction_outcome_block):
-        trial = {
-            "phase": "extinction",
-            "blocknum": block,
-            "stimulus": stimulus,
-            "outcome": outcome,
-            "trialname": str(stimulus) + "_" + str(outcome),
-            "exp_response": None,
-            "pain_response": None,
-            "iti": None
-        }
-        trial_order.append(trial)
-        
-# # Assign trial numbers
-for trialnum, trial in enumerate(trial_order, start=1):
-    trial["trialnum"] = trialnum
+# Define trials: compiled into a columnar schedule, expanded into the trial dicts that store responses
+schedule_filepath = os.path.join(data_folder, P_info["PID"] + "_schedule.json")
+if checkpoint is not None:
+    schedule = load_schedule(schedule_filepath) # the exact design the interrupted session was running
+elif cached_participant is not None:
+    schedule = Schedule.from_dict(cached_participant["schedule"])
+else:
+    schedule = compile_schedule(groupname, block_order)
+if checkpoint is None and groupname != "naturalhistory":
+    schedule.add_sm_ratings(video_painratings_mean,
+                            video_painratings_spread,
+                            seed = video_painratings_seed if video_painratings_seed is not None else P_info["PID"],
+                            match_block_means = video_painratings_match_block_means)
+if checkpoint is None:
+    schedule.save(schedule_filepath) # keep the exact design this participant ran
+trial_order = schedule.trials()
+
+# trials completed before a resume are skipped; their responses come back from the checkpoint
+resume_trialnum = checkpoint["trialnum"] if checkpoint is not None else 0
+if checkpoint is not None:
+    checkpoint_responses.update(checkpoint["responses"])
+    for trialnum, responses in checkpoint["responses"].items():
+        trial_order[int(trialnum) - 1].update(responses)
+    if args.headless and checkpoint["rng_state"] is not None:
+        version, state, gauss = checkpoint["rng_state"]
+        headless.responder.setstate((version, tuple(state), gauss))
+
+def phase_trials(phase):
+    # the phase's trials still to run
+    return [trial for trial in trial_order[schedule.phase(phase)] if trial["trialnum"] > resume_trialnum]
+
+def phase_fresh(phase):
+    # True if no trial of the phase ran before a resume, so its introduction should be shown
+    phase_slice = trial_order[schedule.phase(phase)]
+    return len(phase_slice) > 0 and phase_slice[0]["trialnum"] > resume_trialnum
+
+# only the social model groups use the webcam and movie, and only while conditioning trials remain
+uses_social_model = groupname != "naturalhistory" and len(phase_trials("conditioning")) > 0
     
-save_data(trial_order)
+if checkpoint is not None:
+    truncate_to_checkpoint(resume_trialnum)
+open_data_file(append = checkpoint is not None)
     
 # # text stimuli
 instructions_text = {
@@ -407,7 +893,9 @@ instructions_text = {
     
     "end" : "This concludes the experiment. Please ask the experimenter to help remove the devices.",
     
-    "termination" : "The experiment has been terminated. Please ask the experimenter to help remove the devices."
+    "termination" : "The experiment has been terminated. Please ask the experimenter to help remove the devices.",
+    
+    "resume" : "The experiment will now continue from where it stopped."
 }
     
 if groupname == "naturalhistory":
@@ -466,6 +954,9 @@ elif groupname == "socialmodel":
     "Please ask the experimenter now if you have any questions before proceeding."
     )
 
+warm_text_stims()
+mark_stage("warm text cache")
+
 response_instructions = {
     "pain": "How painful was the heat?",
     "expectancy": "How painful do you expect the thermal stimulus to be?",
@@ -568,44 +1059,297 @@ cue_stims = {"TENS" : visual.Rect(win,
                         autoLog = False)
              }
 
-#Video stimulus (Social modelling)
-video_stim = visual.MovieStim(win,
-                              filename=os.path.join(script_directory, "SMconditioning.mp4"),
-                              size = video_stim_size,
-                              pos = video_stim_pos,
-                              volume = 1.0,
-                              autoStart=True,
-                              loop = False)
-
+webcam_index = 0
+webcam_warmup_frames = 5 # frames grabbed and discarded after opening so exposure/white balance settle before going live
+webcam_recording = args.record_webcam # keep the webcam feed (webcam_recorder.py encodes it in a separate process)
+
+# Webcam capture thread: continuously grabs frames from a cv2.VideoCapture into a small ring buffer with
+# latest-frame-wins semantics, so camera latency never blocks the loops that call win.flip().
+# frames_dropped counts captured frames overwritten before they were displayed,
+# frames_stale counts render frames where no new camera frame had arrived yet.
+# The camera is opened once (with warm-up), shared by webcam_waiting and every show_socialmodel call, and released at exit.
+class WebcamCapture:
+    def __init__(self, camera_index = 0, buffer_size = 3):
+        self.camera_index = camera_index
+        self.capture = None
+        self.open_latency = None
+        self.first_frame_latency = None
+        self.slots = [None] * max(buffer_size, 3) # capture buffers, reused by every read
+        self.lock = threading.Lock()
+        self.latest_slot = None
+        self.reading_slot = None
+        self.latest_id = 0
+        self.consumed_id = 0
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_stale = 0
+        self.failed = False
+        self.running = False
+        self.thread = None
+        self.recorder = None # WebcamRecorder that every captured frame is offered to, if recording
+        self.frame_shape = None # shape of the first frame read when opening
+
+    def open(self):
+        if self.capture is not None:
+            return self.isOpened()
+        open_start = time.perf_counter()
+        self.capture = cv2.VideoCapture(self.camera_index)
+        self.open_latency = time.perf_counter() - open_start
+        if not self.capture.isOpened():
+            print(f"Webcam {self.camera_index} failed to open after {self.open_latency*1000:.0f} ms")
+            return False
+        
+        frame_start = time.perf_counter()
+        got_frame, frame = self.capture.read() # read rather than grab, so the recorder can be sized before capture starts
+        self.first_frame_latency = time.perf_counter() - frame_start
+        if got_frame:
+            self.frame_shape = tuple(frame.shape)
+        for i in range(webcam_warmup_frames - 1):
+            self.capture.grab()
+        print(f"Webcam {self.camera_index} opened in {self.open_latency*1000:.0f} ms, "
+              f"first frame {'after' if got_frame else 'failed after'} {self.first_frame_latency*1000:.0f} ms")
+        return True
+
+    def isOpened(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def start(self):
+        if self.running:
+            return
+        if not self.open():
+            self.failed = True
+            return
+        self.running = True
+        self.failed = False
+        self.thread = threading.Thread(target=self.capture_loop, name="webcam_capture", daemon=True)
+        self.thread.start()
+
+    def capture_loop(self):
+        while self.running:
+            # never write into the newest frame or the one the render loop is uploading
+            with self.lock:
+                slot = next(i for i in range(len(self.slots)) if i != self.latest_slot and i != self.reading_slot)
+            ret, frame = self.capture.read(self.slots[slot])
+            if not ret:
+                self.failed = True
+                break
+            with self.lock:
+                self.slots[slot] = frame
+                if self.latest_id > self.consumed_id:
+                    self.frames_dropped += 1
+                self.latest_slot = slot
+                self.latest_id += 1
+                self.frames_captured += 1
+            if self.recorder is not None:
+                # copied before this thread can reuse the slot; skipped by the recorder if its encoder is behind
+                self.recorder.offer(frame, core.monotonicClock.getTime(), self.frames_captured)
+        self.running = False
+
+    def latest(self):
+        # newest unseen frame, or None if the camera has not produced one since the last call (never blocks)
+        with self.lock:
+            if self.latest_id == self.consumed_id:
+                self.frames_stale += 1
+                return None
+            self.reading_slot = self.latest_slot
+            self.consumed_id = self.latest_id
+            return self.slots[self.reading_slot]
+
+    def stop(self):
+        self.running = False
+        if self.thread is None:
+            return
+        self.thread.join(timeout=1)
+        self.thread = None
+        print(f"Webcam frames captured: {self.frames_captured}, dropped: {self.frames_dropped}, stale: {self.frames_stale}")
+
+    def release(self):
+        if self.capture is None:
+            return
+        self.stop()
+        self.capture.release()
+        self.capture = None
+        if self.recorder is not None:
+            self.recorder.stop()
 
 #turn on webcam
-webcam_feed = cv2.VideoCapture(0)
+webcam_capture = WebcamCapture(webcam_index)
+atexit.register(webcam_capture.release) # opened by the device loader
+
+# Live webcam stimulus: one persistent texture that each raw uint8 BGR frame is uploaded into with glTexSubImage2D.
+# The BGR->RGB conversion happens in the upload (GL_BGR) and the cv2.flip(frame,-1) mirror via flipHoriz/flipVert,
+# so no per-frame arrays, ImageStims or GL textures are created.
+class WebcamStim:
+    def __init__(self, win, pos, size):
+        self.win = win
+        self.pos = pos
+        self.size = size
+        self.stim = None
+        self.frame_shape = None
+
+    def update(self, camera):
+        # upload the newest captured frame if there is one, otherwise keep showing the current texture
+        frame = camera.latest()
+        if frame is not None:
+            self.upload(frame)
+        return not camera.failed
+
+    def upload(self, frame):
+        if self.stim is None or frame.shape != self.frame_shape:
+            # build the texture once at the camera's resolution
+            height, width = frame.shape[:2]
+            self.stim = visual.ImageStim(self.win,
+                                         image = Image.new("RGB", (width, height)),
+                                         pos = self.pos,
+                                         size = self.size,
+                                         flipHoriz = True,
+                                         flipVert = True)
+            self.frame_shape = frame.shape
+        height, width = frame.shape[:2]
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.stim._texID)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, width, height,
+                           GL.GL_BGR, GL.GL_UNSIGNED_BYTE, frame.ctypes.data)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+    def draw(self):
+        if self.stim is not None:
+            self.stim.draw()
+
+webcam_stim = WebcamStim(win, webcam_stim_pos, webcam_stim_size)
+
+#Video stimulus (Social modelling), only created for the groups that see it
+if not uses_social_model:
+    video_stim = None
+else:
+    video_stim = visual.MovieStim(win,
+                                  filename=os.path.join(script_directory, "SMconditioning.mp4"),
+                                  size = video_stim_size,
+                                  pos = video_stim_pos,
+                                  volume = 1.0,
+                                  autoStart=True,
+                                  loop = False)
+    mark_stage("load movie")
+
+# Device loader: imports cv2 and opens the webcam on a background thread while the welcome and TENS introduction
+# screens are up. Anything that needs it calls wait_for_devices() first.
+# Natural history participants never use the webcam or movie, so the loader only runs for the social model groups,
+# and release_social_model() frees both as soon as the conditioning phase that uses them ends.
+devices_ready = threading.Event()
+device_error = None # exception that stopped the device loader, raised again by wait_for_devices
+
+def load_devices():
+    global cv2, device_error
+    try:
+        if args.headless:
+            cv2 = headless.cv2
+        else:
+            import cv2
+        mark_stage("import cv2")
+        webcam_capture.open()
+        if webcam_recording and webcam_capture.frame_shape is not None:
+            # launch the encoder here rather than on the capture thread at its first frame
+            from webcam_recorder import WebcamRecorder
+            recorder = WebcamRecorder(os.path.join(data_folder, f"{P_info['PID']}_webcam_{datetime}.mp4"),
+                                      os.path.join(data_folder, f"{P_info['PID']}_webcam_{datetime}_frames.csv"))
+            recorder.start(webcam_capture.frame_shape)
+            webcam_capture.recorder = recorder
+        elif webcam_recording:
+            print("No frame from the webcam, so it will not be recorded")
+        mark_stage("open webcam")
+    except Exception as error:
+        device_error = error
+        print(f"Loading the webcam failed: {error!r}")
+    finally:
+        devices_ready.set() # never leave anything waiting on a loader that has stopped
+
+def wait_for_devices():
+    if not devices_ready.is_set():
+        wait_start = time.perf_counter()
+        devices_ready.wait()
+        print(f"Waited {(time.perf_counter() - wait_start)*1000:.0f} ms for the webcam to finish loading")
+    if device_error is not None:
+        raise RuntimeError("the webcam could not be loaded") from device_error
+
+def print_startup_report():
+    print("Startup stages (s since launch):")
+    for stage, thread_name, elapsed in sorted(startup_stages, key = lambda stage: stage[2]):
+        print(f"  {elapsed:7.3f}  {stage:<18}{'' if thread_name == 'MainThread' else thread_name}")
+    if uses_social_model and not devices_ready.is_set():
+        print("  device loader still running")
+
+def check_devices():
+    # before the first trial, so a session whose webcam failed to load stops at launch rather than part way
+    if not uses_social_model:
+        return
+    try:
+        wait_for_devices()
+    except RuntimeError as error:
+        print(f"Stopping before the first trial, {error}: {device_error!r}")
+        pport.setData(0)
+        drain_data_writer()
+        exit_screen(instructions_text["termination"])
+        core.quit()
+
+def release_social_model():
+    devices_ready.wait() # release whatever the loader managed to open, even if it failed part way
+    webcam_capture.release()
+    webcam_stim.stim = None
+    video_stim.unload()
+
+if uses_social_model:
+    threading.Thread(target=load_devices, name="device_loader", daemon=True).start()
 
 # Define button_text dictionaries
 #### Make trial functions
+def webcam_text(name):
+    return get_text_stim(instructions_text[name], pos = video_stim_pos, wrapWidth = 800, height = 35)
+
+def rewind_video():
+    # cue the social model video at its start, paused until show_socialmodel plays it
+    video_stim.pause()
+    video_stim.seek(0)
+
+# ITI preloading: the dead time of the ITI before conditioning builds the webcam screens (their text layout isn't
+# prebuilt by warm_text_stims) and cues the social model movie, then the rest of the ITI is waited out.
+def preload_tasks(current_trial):
+    if current_trial["trialnum"] >= len(trial_order):
+        return []
+    next_trial = trial_order[current_trial["trialnum"]] # trialnum is 1-based, so this is the following trial
+    
+    tasks = []
+    if next_trial["phase"] != current_trial["phase"] and next_trial["phase"] == "conditioning" and uses_social_model:
+        tasks += [webcam_text('experiment_webcam_waiting').draw,
+                  webcam_text('experiment_webcam_ready').draw,
+                  rewind_video]
+    return tasks
+
+def iti_wait(duration, current_trial):
+    iti_timer = core.CountdownTimer(duration)
+    for task in preload_tasks(current_trial):
+        if iti_timer.getTime() <= 0:
+            break
+        task()
+    win.clearBuffer() # anything drawn to warm up is never flipped onto the screen
+    core.wait(max(0, iti_timer.getTime()))
+
 def show_fam_trial(current_trial):
     termination_check()
+    publish_trial_start(current_trial)
     # Wait for participant to ready up for shock
-    visual.TextStim(win,
-        text=response_instructions["familiarisation"],
-        height = 35,
-        pos = (0,0),
-        wrapWidth= 800
-        ).draw()
+    get_text_stim(response_instructions["familiarisation"], wrapWidth = 800, height = 35).draw()
     win.flip()
-    event.waitKeys(keyList = ["space"])
+    input_service.wait_for(["space"])
     
     # show fixation stimulus + deliver shock
-    if pport != None:
-        pport.setData(0)
+    pport.setData(0)
 
     fix_stim.draw()
     win.flip()
     
-    if pport != None:
-        pport.setData(pain_trig+eda_trig)
-        core.wait(port_buffer_duration)
-        pport.setData(0)
+    pport.setData(pain_trig+eda_trig)
+    core.wait(port_buffer_duration)
+    pport.setData(0)
     
     # Get pain rating
     while fam_rating.getRating() is None: # while mouse unclicked
@@ -626,250 +1370,196 @@ def show_fam_trial(current_trial):
     fam_rating.reset()
     
     win.flip()
-    core.wait(familiarisation_iti)
+    iti_wait(familiarisation_iti, current_trial)
+    save_trial(current_trial)
+    
+# Trial timeline engine: a trial is a list of segments, each a dict with
+#   "duration": seconds (or "until": a function that ends the segment once it returns True)
+#   "name": segment label used to tag frame timing records
+#   "draw": stimuli drawn on every frame of the segment
+#   "trace": name of a rating_stim slider whose rating is recorded every frame (see SliderTrace)
+#   "countdown": draw the countdown number, counting down to the end of the consecutive countdown segments
+#   "on_start"/"on_end": actions run before its first/after its last frame (port states, TENS, ratings)
+# One loop runs every segment. Each flip is assigned to the segment its predicted onset time falls in, so
+# segment changes land on the frame where they are displayed.
+# Frames are drawn from a retained render list (countdown number + segment stimuli, each stimulus once) that is
+# only rebuilt when the segment or the countdown number changes.
+def run_timeline(segments, current_trial = None, next_flip = None):
+    frame_period = win.monitorFramePeriod
+    last_flip = None
+    if next_flip is None:
+        next_flip = core.monotonicClock.getTime() + frame_period
+    else:
+        last_flip = next_flip - frame_period
     
+    segment_start = next_flip
+    countdown_end = None
+    for index, segment in enumerate(segments):
+        if not segment.get("countdown"):
+            countdown_end = None
+        elif countdown_end is None:
+            # the countdown runs to the end of this and the following consecutive countdown segments
+            countdown_end = segment_start
+            for following in segments[index:]:
+                if not following.get("countdown"):
+                    break
+                countdown_end += following["duration"]
+        segment_end = segment_start + segment["duration"] if "duration" in segment else None
+        until = segment.get("until")
+        countdown_stim = None
+        render_list = build_render_list(segment.get("draw", []))
+        trace_name = segment.get("trace") if current_trial is not None else None
+        
+        if "on_start" in segment:
+            segment["on_start"]()
+        while True:
+            termination_check()
+            if segment_end is not None and next_flip >= segment_end:
+                break
+            if until is not None and until():
+                break
+            if countdown_end is not None:
+                number_stim = countdown_text[str(max(0, min(10, int(math.ceil(countdown_end - next_flip)))))]
+                if number_stim is not countdown_stim:
+                    countdown_stim = number_stim
+                    render_list = build_render_list([countdown_stim] + segment.get("draw", []))
+            for stim in render_list:
+                stim.draw()
+            flip_time = win.flip()
+            if record_frame_timing and current_trial is not None:
+                log_frame(current_trial, segment.get("name"), flip_time, last_flip, frame_period, len(render_list))
+            if trace_name is not None:
+                trace_slider(current_trial, trace_name, flip_time)
+            last_flip = flip_time
+            next_flip = flip_time + frame_period
+        if "on_end" in segment:
+            segment["on_end"]()
+        
+        # timed segments chain exactly so rounding never accumulates; untimed ones hand over at the next flip
+        segment_start = segment_end if segment_end is not None else next_flip
+    return next_flip
+
 def show_trial(current_trial,
                trialtype,
                video = None):
    
-    if pport != None:
-        pport.setData(0)
+    publish_trial_start(current_trial)
+    pport.setData(0)
     
     if trialtype == "socialmodel":
-        iti = video_stim_iti    
+        trial_iti = video_stim_iti    
     else: 
-        iti = iti
-        
-    win.flip()
+        trial_iti = iti
     
-    # Set the initial countdown time to 10 seconds
-    countdown_timer = core.CountdownTimer(10)  
-
-    #if pre-exposure, only show and activate TENS
-    if trialtype == "preexposure":  
-        if groupname == 'preexposure':
-            while countdown_timer.getTime() > 8:
-                termination_check()
-                trial_text["preexposure"].draw()
-                win.flip()
-                
-            TENS_timer = countdown_timer.getTime() + TENS_pulse_int
-                            
-            while countdown_timer.getTime() < 8 and countdown_timer.getTime() > 0: #turn on TENS at 8 seconds
-                termination_check()
-                
-                if pport != None:
-                # turn on TENS pulses if TENS trial, at an on/off interval speed of TENS_pulse_int, marking TENS onset with EDA trig
-                    pport.setData(tens_trig[current_trial["stimulus"]] + eda_trig)
-                    if countdown_timer.getTime() < TENS_timer - TENS_pulse_int:
-                        pport.setData(tens_trig[current_trial["stimulus"]])
-                    if countdown_timer.getTime() < TENS_timer - TENS_pulse_int*2:
-                        pport.setData(0)
-                        TENS_timer = countdown_timer.getTime() 
-                cue_stims[current_trial["stimulus"]].draw()
-                trial_text["preexposure"].draw()
-                win.flip() 
-            
-            if pport != None:    
-                pport.setData(0)
-                
-        elif groupname != 'preexposure':
-            while countdown_timer.getTime() > 0:
-                termination_check()
-                trial_text["preexposure"].draw()
-                win.flip()
-
-        win.flip()
-        core.wait(iti)   
-        current_trial["iti"] = iti
-        
-# social modelling conditioning trials
-    if trialtype == "socialmodel":
-        while countdown_timer.getTime() > 8:
-            termination_check()
-            countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
-            video.draw()
-            win.flip()
-            
-        while countdown_timer.getTime() < 8 and countdown_timer.getTime() > 7: #turn on TENS at 8 seconds
-            termination_check()
-            countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
-            cue_stims[current_trial["stimulus"]].draw()
-            video.draw()
-            win.flip()
-
-        while countdown_timer.getTime() < 7 and countdown_timer.getTime() > 0: #ask for expectancy at 7 seconds
-            termination_check()
-            countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
-            video.draw()
-            cue_stims[current_trial["stimulus"]].draw()
-            
-            # Ask for expectancy rating
-            trial_text["expectancy"].draw()
-            exp_rating.draw()
-            video.draw()
-            win.flip()    
-
+    stimulus = current_trial["stimulus"]
+    cue = cue_stims[stimulus]
+    
+    def start_tens(eda_duration):
+        # turn on TENS pulses if TENS trial, at an on/off interval speed of TENS_pulse_int, marking TENS onset with EDA trig
+        return lambda: tens_pulser.start(stimulus, current_trial["trialnum"], eda_duration = eda_duration)
+    
+    def stop_tens():
+        tens_pulser.stop()
+        pport.setData(0)
+    
+    def record_expectancy():
         current_trial["exp_response"] = exp_rating.getRating() #saves the expectancy response for that trial
+        publish("rating", trialnum = current_trial["trialnum"], slider = "expectancy", rating = current_trial["exp_response"])
         exp_rating.reset() #resets the expectancy slider for subsequent trials
-        
-        buffer_timer = core.CountdownTimer(video_painratings_buffer)   
-                       
-        while buffer_timer.getTime() > 0:
-            video.draw()
-            win.flip() 
-
-        # present social model's pain rating 
-        pain_rating_sm = random.normalvariate(
-                video_painratings_mean[current_trial["stimulus"]],
-                video_painratings_spread[current_trial["stimulus"]])
-        
-        pain_rating.rating = pain_rating_sm
+    
+    def show_sm_rating():
+        # present social model's pain rating, pre-generated with the schedule
+        pain_rating.rating = current_trial["sm_rating"]
         pain_rating.readOnly = True
+    
+    # 10 second countdown: cue and TENS on at 8 seconds, expectancy rating from 7 seconds
+    if trialtype == "preexposure":
+        #if pre-exposure, only show and activate TENS
+        if groupname == 'preexposure':
+            timeline = [{"name": "waiting", "duration": 2, "draw": [trial_text["preexposure"]]},
+                        {"name": "tens", "duration": 8, "draw": [cue, trial_text["preexposure"]], "on_start": start_tens(8), "on_end": stop_tens}]
+        else:
+            timeline = [{"name": "waiting", "duration": 10, "draw": [trial_text["preexposure"]]}]
+            
+    elif trialtype == "socialmodel":
+        # social modelling conditioning trials, followed by the video buffer and the social model's pain rating
+        timeline = [{"name": "countdown", "duration": 2, "countdown": True, "draw": [video]},
+                    {"name": "cue", "duration": 1, "countdown": True, "draw": [cue, video]},
+                    {"name": "expectancy", "duration": 7, "countdown": True, "draw": [video, cue, trial_text["expectancy"], exp_rating], "trace": "expectancy", "on_end": record_expectancy},
+                    {"name": "buffer", "duration": video_painratings_buffer, "draw": [video]},
+                    {"name": "sm_rating", "duration": trial_iti, "draw": [video, trial_text["SMrating"], pain_rating], "on_start": show_sm_rating}]
         
-        iti_timer = core.CountdownTimer(iti)
+    elif trialtype == "standard":
+        #if it's a conditioning/extinction trial, do regular 10 second countdown with stimuli + pain stimulus etc.  
+        timeline = [{"name": "countdown", "duration": 2, "countdown": True},
+                    {"name": "cue", "duration": 1, "countdown": True, "draw": [cue], "on_start": start_tens(1)},
+                    {"name": "expectancy", "duration": 7, "countdown": True, "draw": [cue, trial_text["expectancy"], exp_rating], "trace": "expectancy", "on_end": stop_tens}]
+    
+    run_timeline(timeline, current_trial, next_flip = win.flip() + win.monitorFramePeriod)
+    
+    if trialtype == "preexposure":
+        win.flip()
+        iti_wait(trial_iti, current_trial)
         
-        while iti_timer.getTime() > 0:
-            video.draw()
-            trial_text["SMrating"].draw()
-            pain_rating.draw()
-            win.flip()
-
-                
+    elif trialtype == "socialmodel":
         current_trial["pain_response"] = pain_rating.getRating()
         pain_rating.reset()
-
         win.flip()
         
-        current_trial["iti"] = iti
-            
-    #if it's a conditioning/extinction trial, do regular 10 second countdown with stimuli + pain stimulus etc.  
-      
-    elif trialtype == "standard": 
-        while countdown_timer.getTime() > 8:
-            termination_check()
-            countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
-            win.flip()
-        
-            TENS_timer = countdown_timer.getTime() + TENS_pulse_int
-            
-        while countdown_timer.getTime() < 8 and countdown_timer.getTime() > 7: #turn on TENS at 8 seconds
-            termination_check()
-            
-            if pport != None:
-                # turn on TENS pulses if TENS trial, at an on/off interval speed of TENS_pulse_int, marking TENS onset with EDA trig
-                pport.setData(tens_trig[current_trial["stimulus"]] + eda_trig)
-                if countdown_timer.getTime() < TENS_timer - TENS_pulse_int:
-                    pport.setData(tens_trig[current_trial["stimulus"]])
-                if countdown_timer.getTime() < TENS_timer - TENS_pulse_int*2:
-                    pport.setData(0)
-                    TENS_timer = countdown_timer.getTime() 
-
-            countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
-            cue_stims[current_trial["stimulus"]].draw()
-            win.flip()
-
-        
-        TENS_timer = countdown_timer.getTime() + TENS_pulse_int
-
-        while countdown_timer.getTime() < 7 and countdown_timer.getTime() > 0: #ask for expectancy at 7 seconds
-            if pport != None:
-                termination_check()                        
-                # turn on TENS pulses if TENS trial, at an on/off interval speed of TENS_pulse_int
-                if countdown_timer.getTime() < TENS_timer - TENS_pulse_int:
-                    pport.setData(tens_trig[current_trial["stimulus"]])
-                if countdown_timer.getTime() < TENS_timer - TENS_pulse_int*2:
-                    pport.setData(0)
-                    TENS_timer = countdown_timer.getTime() 
-
-            countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
-            cue_stims[current_trial["stimulus"]].draw()
-            
-            # Ask for expectancy rating
-            trial_text["expectancy"].draw()
-            exp_rating.draw()
-            win.flip()    
-
-        current_trial["exp_response"] = exp_rating.getRating() #saves the expectancy response for that trial
-        exp_rating.reset() #resets the expectancy slider for subsequent trials
+    elif trialtype == "standard":
+        record_expectancy()
                 
         # deliver shock
-        if pport != None:
-            pport.setData(0)
         fix_stim.draw()
         win.flip()
         
-        if pport != None:
-            pport.setData(pain_trig+eda_trig)
-            core.wait(port_buffer_duration)
-            pport.setData(0)
+        pport.setData(pain_trig+eda_trig)
+        core.wait(port_buffer_duration)
+        pport.setData(0)
 
-        # Get pain rating
-        while pain_rating.getRating() is None: # while mouse unclicked
-            pain_rating.readOnly = False
-            termination_check()
-            pain_rating.draw()
-            trial_text["pain"].draw()
-            win.flip()
-                
-                
-        pain_response_end_time = core.getTime() + response_hold_duration # amount of time for participants to adjust slider after making a response
-        
-        while core.getTime() < pain_response_end_time:
-            termination_check()
-            trial_text["pain"].draw()
-            pain_rating.draw()
-            win.flip()
+        # Get pain rating, held on screen for response_hold_duration after the first click
+        pain_rating.readOnly = False
+        run_timeline([{"name": "pain_rating", "until": lambda: pain_rating.getRating() is not None, "draw": [pain_rating, trial_text["pain"]], "trace": "pain"},
+                      {"name": "pain_hold", "duration": response_hold_duration, "draw": [trial_text["pain"], pain_rating], "trace": "pain"}],
+                     current_trial)
             
         current_trial["pain_response"] = pain_rating.getRating()
+        publish("rating", trialnum = current_trial["trialnum"], slider = "pain", rating = current_trial["pain_response"])
         pain_rating.reset()
 
         win.flip()
-        core.wait(iti)
-        current_trial["iti"] = iti
+        iti_wait(trial_iti, current_trial)
+        
+    current_trial["iti"] = trial_iti
+    current_trial["tens_pulse_edges"], current_trial["tens_pulse_max_lag"] = tens_pulser.pop_trial_stats()
+    summarise_frames(current_trial)
+    summarise_slider_traces(current_trial)
+    save_trial(current_trial)
         
 def webcam_waiting(waittime = 5):
     termination_check()
     global exp_finish
     
-    if not webcam_feed.isOpened():
+    wait_for_devices()
+    if not webcam_capture.isOpened():
         print("Failed to open webcam.")
         exp_finish = True
         return
     
+    webcam_capture.start()
 
-    waiting_text = visual.TextStim(win,
-                        text=instructions_text['experiment_webcam_waiting'],
-                        height = 35,
-                        pos = video_stim_pos,
-                        wrapWidth= 800
-                        )
-    ready_text = visual.TextStim(win,
-                        text=instructions_text['experiment_webcam_ready'],
-                        height = 35,
-                        pos = video_stim_pos,
-                        wrapWidth= 800
-                        )
+    waiting_text = webcam_text('experiment_webcam_waiting')
+    ready_text = webcam_text('experiment_webcam_ready')
     waittimer = core.CountdownTimer(waittime)  
     
     while waittimer.getTime() > 0:
         termination_check()
-        # capture each frame of webcam feed in RGB
-        ret, webcam_frame = webcam_feed.read() 
-        if not ret: #if there is no image returned from webcam_feed.read(), break loop and print error message
+        # show the newest frame from the webcam capture thread in the persistent webcam texture
+        if not webcam_stim.update(webcam_capture): #if the capture thread failed to get an image from the webcam, break loop and print error message
             print("failed to capture image")
             exp_finish = True
             break
         
-        webcam_frame = cv2.flip(webcam_frame,-1) 
-        webcam_frame = cv2.cvtColor(webcam_frame, cv2.COLOR_BGR2RGB)
-        ## Normalize the frame to be in the range -1 to 1
-        webcam_frame = webcam_frame / 255.0
-        webcam_stim = visual.ImageStim(win,
-                                       image = webcam_frame,
-                                       pos = webcam_stim_pos,
-                                       size = webcam_stim_size    
-                                       )
         webcam_stim.draw()
         waiting_text.draw()     
         win.flip()
@@ -878,145 +1568,161 @@ def webcam_waiting(waittime = 5):
         
     while not space_pressed:
         termination_check()
-        # capture each frame of webcam feed in RGB
-        ret, webcam_frame = webcam_feed.read() 
-        if not ret: #if there is no image returned from webcam_feed.read(), break loop and print error message
+        # show the newest frame from the webcam capture thread in the persistent webcam texture
+        if not webcam_stim.update(webcam_capture): #if the capture thread failed to get an image from the webcam, break loop and print error message
             print("failed to capture image")
             exp_finish = True
             break
         
-        webcam_frame = cv2.flip(webcam_frame,-1) 
-        webcam_frame = cv2.cvtColor(webcam_frame, cv2.COLOR_BGR2RGB)
-        ## Normalize the frame to be in the range -1 to 1
-        webcam_frame = webcam_frame / 255.0
-        webcam_stim = visual.ImageStim(win,
-                                       image = webcam_frame,
-                                       pos = webcam_stim_pos,
-                                       size = webcam_stim_size    
-                                       )
         webcam_stim.draw()
         ready_text.draw()     
         win.flip()
         # Check for key presses
-        keys = event.getKeys()
-        if 'space' in keys:
+        if input_service.get_press(["space"]) is not None:
             space_pressed = True
             
 def show_socialmodel(playtime = 10,socialmodel_stim = video_stim,webcam = True):
     global exp_finish
     termination_check() 
-    webcam_feed = cv2.VideoCapture(0)
+    wait_for_devices()
+    socialmodel_stim.play()
+    if webcam == True or webcam_recording:
+        webcam_capture.start() # reuses the already open camera, no-op if capture is still running
     sm_timer = core.CountdownTimer(playtime)
     while sm_timer.getTime() > 0: 
-        # capture each frame of webcam feed in RGB
-        ret, webcam_frame = webcam_feed.read() 
-        if not ret: #if there is no image returned from webcam_feed.read(), break loop and print error message
-            print("failed to capture image")
-            exp_finish = True
-            break
+        if webcam == True:
+            # show the newest frame from the webcam capture thread in the persistent webcam texture
+            if not webcam_stim.update(webcam_capture): #if the capture thread failed to get an image from the webcam, break loop and print error message
+                print("failed to capture image")
+                exp_finish = True
+                break
         
-        webcam_frame = cv2.flip(webcam_frame,-1) 
-        webcam_frame = cv2.cvtColor(webcam_frame, cv2.COLOR_BGR2RGB)
-        ## Normalize the frame to be in the range -1 to 1
-        webcam_frame = webcam_frame / 255.0
-        webcam_stim = visual.ImageStim(win,
-                                       image = webcam_frame,
-                                       pos = webcam_stim_pos,
-                                       size = webcam_stim_size    
-                                       )
         socialmodel_stim.draw()
         if webcam == True: 
             webcam_stim.draw()
         win.flip()
+    
+    if not webcam_recording:
+        webcam_capture.stop() # the camera isn't shown again, so don't keep capturing through the conditioning trials
         
     
 
 exp_finish = None        
-lastblocknum = None
+lastblocknum = checkpoint["lastblocknum"] if checkpoint is not None else None
 
 # Run experiment
 while not exp_finish:
     termination_check()
     
     ### introduce TENS and run familiarisation procedure
-    instruction_trial(instructions_text["welcome"],3)
-    instruction_trial(instructions_text["TENS_introduction"],5)
-    instruction_trial(instructions_text["familiarisation_1"],5)
-    instruction_trial(instructions_text["familiarisation_2"],5)
+    win.callOnFlip(mark_stage, "first frame")
+    if phase_fresh("familiarisation"):
+        instruction_trial(instructions_text["welcome"],3)
+        instruction_trial(instructions_text["TENS_introduction"],5)
+        print_startup_report()
+        check_devices()
+        instruction_trial(instructions_text["familiarisation_1"],5)
+        instruction_trial(instructions_text["familiarisation_2"],5)
+    else:
+        print_startup_report()
+        check_devices()
+        instruction_trial(instructions_text["resume"],3)
     
-    for trial in list(filter(lambda trial: trial['phase'] == "familiarisation", trial_order)):
+    familiarisation_trials = phase_trials("familiarisation")
+    for trial in familiarisation_trials:
         show_fam_trial(trial)
-    instruction_trial(instructions_text["familiarisation_finish"],2)
+        save_checkpoint(trial)
+    if familiarisation_trials:
+        instruction_trial(instructions_text["familiarisation_finish"],2)
 
     ### pre-exposure phase
-    instruction_trial(instructions_text["preexposure"])
+    if phase_fresh("preexposure"):
+        instruction_trial(instructions_text["preexposure"])
 
-    for trial in list(filter(lambda trial: trial['phase'] == "preexposure", trial_order)):
+    preexposure_trials = phase_trials("preexposure")
+    for trial in preexposure_trials:
         show_trial(trial,"preexposure")
+        save_checkpoint(trial)
     
-    instruction_trial(instructions_text["preexposure_completed"])
+    if preexposure_trials:
+        instruction_trial(instructions_text["preexposure_completed"])
 
     # run conditioning and extinction phases
-    instruction_trial(instructions_text["conditioning"])
+    if phase_fresh("conditioning"):
+        instruction_trial(instructions_text["conditioning"])
 
     #natural history just experiences all trials normally
     if groupname == "naturalhistory":
-        for trial in list(filter(lambda trial: trial['phase'] == "conditioning", trial_order)):
+        for trial in phase_trials("conditioning"):
             current_blocknum = trial['blocknum']
             if lastblocknum is not None and current_blocknum != lastblocknum:
                 instruction_trial(instructions_text["blockrest"],10)
             show_trial(trial,"standard")
             lastblocknum = current_blocknum
-        for trial in list(filter(lambda trial: trial['phase'] == "extinction", trial_order)):
+            save_checkpoint(trial)
+        for trial in phase_trials("extinction"):
             current_blocknum = trial['blocknum']
             if lastblocknum is not None and current_blocknum != lastblocknum:
                 lastblocknum = current_blocknum
                 instruction_trial(instructions_text["blockrest"],10)
             show_trial(trial,"standard")
             lastblocknum = current_blocknum
+            save_checkpoint(trial)
         
     elif groupname != "naturalhistory":
-        #run social modelling manipulation
-        webcam_waiting()
-        show_socialmodel(playtime = 60,
-                         socialmodel_stim=video_stim,
-                         webcam=True)
-            
-        for trial in list(filter(lambda trial: trial['phase'] == "conditioning", trial_order)):
-            current_blocknum = trial['blocknum']
-            if lastblocknum is not None and current_blocknum != lastblocknum:
-                lastblocknum = current_blocknum
+        conditioning_trials = phase_trials("conditioning")
+        if conditioning_trials:
+            if phase_fresh("conditioning"):
+                #run social modelling manipulation
+                webcam_waiting()
+                show_socialmodel(playtime = 60,
+                                 socialmodel_stim=video_stim,
+                                 webcam=True)
+            else:
+                # resumed part way through conditioning: restart the video with the between-block clip
                 show_socialmodel(playtime = 20,
-                    socialmodel_stim=video_stim,
-                    webcam=None)
-            show_trial(trial,
-                    trialtype="socialmodel",
-                    video=video_stim)
-    
-        #keep video going after conditioning phase and then flip at end:
-        video_stim.draw()
-        win.flip()
-        
-        if video_stim.isFinished == True: 
-            video_stim.stop()
-        win.flip()
+                                 socialmodel_stim=video_stim,
+                                 webcam=None)
+                
+            for trial in conditioning_trials:
+                current_blocknum = trial['blocknum']
+                if lastblocknum is not None and current_blocknum != lastblocknum:
+                    lastblocknum = current_blocknum
+                    show_socialmodel(playtime = 20,
+                        socialmodel_stim=video_stim,
+                        webcam=None)
+                show_trial(trial,
+                        trialtype="socialmodel",
+                        video=video_stim)
+                save_checkpoint(trial)
         
-        instruction_trial(instructions_text["experiment_webcam_finish"],3)
+            #keep video going after conditioning phase and then flip at end:
+            video_stim.draw()
+            win.flip()
+            
+            if video_stim.isFinished == True: 
+                video_stim.stop()
+            win.flip()
+            release_social_model()
+            
+            instruction_trial(instructions_text["experiment_webcam_finish"],3)
         
-        instruction_trial(instructions_text["extinction"],10)
+        if phase_fresh("extinction"):
+            instruction_trial(instructions_text["extinction"],10)
 
-        for trial in list(filter(lambda trial: trial['phase'] == "extinction", trial_order)):
+        for trial in phase_trials("extinction"):
             current_blocknum = trial['blocknum']
             if lastblocknum is not None and current_blocknum != lastblocknum:
                 instruction_trial(instructions_text["blockrest"],10)
             show_trial(trial,"standard")
             lastblocknum = current_blocknum
+            save_checkpoint(trial)
 
-    if pport != None:
-        pport.setData(0)
-        
-    # save trial data
-    save_data(trial_order)
+    pport.setData(0)
+    publish("session_end", trialnum = len(trial_order))
+    
+    # finish writing trial data
+    drain_data_writer()
     exit_screen(instructions_text["end"])
     
     exp_finish = True
@@ -0,0 +1,205 @@
+# Aggregate every participant's <PID>_responses.csv in the data folder into one typed columnar dataset, and
+# summarise expectancy and pain ratings per group, phase and stimulus.
+# In social model conditioning trials pain_response holds the demonstrator's rating shown on screen (sm_rating), not
+# the participant's, so those are summarised as sm_rating and left out of the participant pain columns.
+# Files are parsed in parallel across a process pool. Each parsed file is cached as a .npz next to a manifest of
+# file modification times, so re-runs only re-read response files that are new or have changed.
+# The dataset is written as Parquet when pyarrow is installed, otherwise as a NumPy .npz of column arrays.
+#
+# e.g. python analyse_sessions.py                       (reads data/ next to this script)
+#      python analyse_sessions.py sim_data --recursive  (reads simulate_sessions.py output, one folder per session)
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+
+# response file columns kept in the dataset and their types; empty cells become NaN (float) or -1 (int)
+column_types = {"PID": str,
+                "group": int,
+                "groupname": str,
+                "cb": int,
+                "phase": str,
+                "blocknum": int,
+                "trialnum": int,
+                "stimulus": str,
+                "outcome": str,
+                "trialname": str,
+                "exp_response": float,
+                "pain_response": float,
+                "iti": float,
+                "exp_first_rt": float,
+                "exp_final_rt": float,
+                "exp_adjustments": int,
+                "pain_first_rt": float,
+                "pain_final_rt": float,
+                "pain_adjustments": int,
+                "frame_mean": float,
+                "frame_max": float,
+                "frames_dropped": int,
+                "datetime": str}
+
+summary_colnames = ["groupname", "phase", "stimulus", "participants", "trials",
+                    "exp_mean", "exp_sd", "exp_n", "pain_mean", "pain_sd", "pain_n",
+                    "sm_rating_mean", "sm_rating_sd", "sm_rating_n"]
+
+
+def parse_value(value, column_type):
+    if value is None or value == "":
+        return float("nan") if column_type is float else -1 if column_type is int else ""
+    if column_type is int:
+        return int(float(value))
+    return column_type(value)
+
+
+def read_responses(filepath):
+    # one response file -> {column: array}, run in a worker process
+    columns = {column: [] for column in column_types}
+    with open(filepath, newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            for column, column_type in column_types.items():
+                columns[column].append(parse_value(row.get(column), column_type))
+    return {column: np.array(values, dtype=column_types[column]) for column, values in columns.items()}
+
+
+def cache_path(cache_folder, relative_path):
+    return os.path.join(cache_folder, relative_path.replace(os.sep, "__") + ".npz")
+
+
+def load_dataset(data_folder, output_folder, recursive = False, workers = None):
+    cache_folder = os.path.join(output_folder, "cache")
+    manifest_path = os.path.join(output_folder, "manifest.json")
+    os.makedirs(cache_folder, exist_ok=True)
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        manifest = {}
+
+    pattern = os.path.join(data_folder, "**", "*_responses.csv") if recursive else os.path.join(data_folder, "*_responses.csv")
+    filepaths = sorted(glob.glob(pattern, recursive=recursive))
+    relative_paths = [os.path.relpath(filepath, data_folder) for filepath in filepaths]
+    mtimes = [os.stat(filepath).st_mtime_ns for filepath in filepaths]
+
+    # re-read only files that are new, have changed since the last run, or lost their cached copy
+    stale = [index for index, (relative_path, mtime) in enumerate(zip(relative_paths, mtimes))
+             if manifest.get(relative_path) != mtime or not os.path.exists(cache_path(cache_folder, relative_path))]
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for index, columns in zip(stale, executor.map(read_responses, [filepaths[index] for index in stale])):
+                np.savez(cache_path(cache_folder, relative_paths[index]), **columns)
+                manifest[relative_paths[index]] = mtimes[index]
+
+    # drop files that have been removed from the data folder
+    for relative_path in set(manifest) - set(relative_paths):
+        if os.path.exists(cache_path(cache_folder, relative_path)):
+            os.remove(cache_path(cache_folder, relative_path))
+        del manifest[relative_path]
+    with open(manifest_path, mode="w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+    parts = []
+    for relative_path in relative_paths:
+        with np.load(cache_path(cache_folder, relative_path)) as cached:
+            parts.append({column: cached[column] for column in column_types})
+    if not parts:
+        return {column: np.array([], dtype=column_type) for column, column_type in column_types.items()}, len(stale)
+    return {column: np.concatenate([part[column] for part in parts]) for column in column_types}, len(stale)
+
+
+def save_dataset(dataset, output_folder):
+    if pyarrow is not None:
+        filepath = os.path.join(output_folder, "responses.parquet")
+        pyarrow.parquet.write_table(pyarrow.table(dataset), filepath)
+    else:
+        filepath = os.path.join(output_folder, "responses.npz")
+        np.savez(filepath, **dataset)
+    return filepath
+
+
+def rating_summary(values):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return "", "", 0
+    return float(values.mean()), float(values.std(ddof=1)) if len(values) > 1 else "", len(values)
+
+
+def social_model_trials(dataset):
+    # conditioning trials of every group but natural history are social model trials
+    return (dataset["phase"] == "conditioning") & (dataset["groupname"] != "naturalhistory")
+
+
+def summarise(dataset):
+    # one row per group x phase x stimulus (familiarisation trials have no stimulus)
+    rows = []
+    social_model = social_model_trials(dataset)
+    keys = sorted(set(zip(dataset["groupname"], dataset["phase"], dataset["stimulus"])))
+    for groupname, phase, stimulus in keys:
+        selected = (dataset["groupname"] == groupname) & (dataset["phase"] == phase) & (dataset["stimulus"] == stimulus)
+        exp_mean, exp_sd, exp_n = rating_summary(dataset["exp_response"][selected])
+        pain_mean, pain_sd, pain_n = rating_summary(dataset["pain_response"][selected & ~social_model])
+        sm_rating_mean, sm_rating_sd, sm_rating_n = rating_summary(dataset["pain_response"][selected & social_model])
+        rows.append({"groupname": groupname,
+                     "phase": phase,
+                     "stimulus": stimulus,
+                     "participants": len(set(dataset["PID"][selected])),
+                     "trials": int(selected.sum()),
+                     "exp_mean": exp_mean,
+                     "exp_sd": exp_sd,
+                     "exp_n": exp_n,
+                     "pain_mean": pain_mean,
+                     "pain_sd": pain_sd,
+                     "pain_n": pain_n,
+                     "sm_rating_mean": sm_rating_mean,
+                     "sm_rating_sd": sm_rating_sd,
+                     "sm_rating_n": sm_rating_n})
+    return rows
+
+
+def format_rating(mean, sd):
+    if mean == "":
+        return "-"
+    return f"{mean:.1f}" + (f" ({sd:.1f})" if sd != "" else "")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate and summarise LI1 response files")
+    parser.add_argument("data_folder", nargs="?", default=os.path.join(script_directory, "data"))
+    parser.add_argument("--output-folder", help="where the dataset, summary and cache go (default: <data_folder>/analysis)")
+    parser.add_argument("--recursive", action="store_true", help="also read response files in subfolders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="files parsed at once")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_folder):
+        sys.exit(f"No data folder at {args.data_folder}")
+    output_folder = args.output_folder if args.output_folder is not None else os.path.join(args.data_folder, "analysis")
+
+    run_start = time.perf_counter()
+    dataset, num_read = load_dataset(args.data_folder, output_folder, args.recursive, args.workers)
+    dataset_path = save_dataset(dataset, output_folder)
+    summary = summarise(dataset)
+    with open(os.path.join(output_folder, "summary.csv"), mode="w", newline="") as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=summary_colnames)
+        writer.writeheader()
+        writer.writerows(summary)
+
+    print(f"{'group':<16}{'phase':<17}{'stimulus':<10}{'PIDs':>5}{'trials':>8}  {'expectancy':<14}{'pain':<14}{'model pain':<14}")
+    for row in summary:
+        print(f"{row['groupname']:<16}{row['phase']:<17}{row['stimulus']:<10}{row['participants']:>5}{row['trials']:>8}  "
+              f"{format_rating(row['exp_mean'], row['exp_sd']):<14}{format_rating(row['pain_mean'], row['pain_sd']):<14}"
+              f"{format_rating(row['sm_rating_mean'], row['sm_rating_sd']):<14}")
+    print(f"{len(dataset['PID'])} trials from {len(set(dataset['PID']))} participants ({num_read} files re-read) "
+          f"in {time.perf_counter() - run_start:.1f} s -> {dataset_path}")
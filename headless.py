@@ -0,0 +1,246 @@
+# Headless stand-ins for psychopy, cv2 and OpenGL, used by `python LI1.py --headless`
+# Everything runs on a virtual clock: win.flip() advances it by one frame and core.wait() jumps it forward,
+# so a full session runs far faster than real time without a display, camera or parallel port.
+# A synthetic participant answers every slider and presses space, each after a random response time.
+import heapq
+import random
+import sys
+import time
+import types
+
+frame_rate = 60
+responder = random.Random(0)
+rating_rt_range = (0.5, 3.0) # seconds from a slider first being shown until the simulated participant clicks it
+key_rt_range = (0.5, 2.0) # seconds from the keyboard being cleared (or its last press) until the next space press
+
+
+def configure(seed = None, rate = None):
+    global frame_rate
+    responder.seed(seed)
+    if rate is not None:
+        frame_rate = rate
+
+
+## virtual clock
+class VirtualClock:
+    # timers (call_at) fire in order as the clock passes their time, with the clock set to exactly that time,
+    # so threads that would sleep until a deadline (the TENS pulser) can be driven on the virtual clock instead
+    def __init__(self):
+        self.now = 0.0
+        self.timers = [] # heap of (time, order, function)
+        self.timer_count = 0
+
+    def call_at(self, when, function):
+        self.timer_count += 1
+        heapq.heappush(self.timers, (when, self.timer_count, function))
+
+    def advance(self, duration):
+        target = self.now + max(0.0, duration)
+        while self.timers and self.timers[0][0] <= target:
+            when, order, function = heapq.heappop(self.timers)
+            self.now = max(self.now, when)
+            function()
+        self.now = target
+
+virtual_clock = VirtualClock()
+
+
+class Clock:
+    def __init__(self):
+        self.start = virtual_clock.now
+
+    def getTime(self):
+        return virtual_clock.now - self.start
+
+    def reset(self, newT = 0.0):
+        self.start = virtual_clock.now + newT
+
+
+class CountdownTimer:
+    def __init__(self, start = 0):
+        self.end = virtual_clock.now + start
+
+    def getTime(self):
+        return self.end - virtual_clock.now
+
+    def reset(self, t = 0):
+        self.end = virtual_clock.now + t
+
+
+def quit():
+    sys.exit(0)
+
+core = types.SimpleNamespace(getTime = lambda: virtual_clock.now,
+                             wait = virtual_clock.advance,
+                             monotonicClock = Clock(),
+                             Clock = Clock,
+                             CountdownTimer = CountdownTimer,
+                             quit = quit)
+
+
+## keyboard: the simulated participant never presses escape, and presses space a response time after the keyboard
+## is cleared (as InputService.wait_for does) or after its previous press
+class KeyPress:
+    def __init__(self, name, tDown):
+        self.name = name
+        self.tDown = tDown
+
+class Keyboard:
+    def __init__(self):
+        self.press_at = None
+
+    def getKeys(self, keyList = None, waitRelease = False, clear = True):
+        if self.press_at is None:
+            self.press_at = virtual_clock.now + responder.uniform(*key_rt_range)
+        if virtual_clock.now < self.press_at or (keyList is not None and "space" not in keyList):
+            return []
+        press = KeyPress("space", self.press_at)
+        self.press_at = None
+        return [press]
+
+    def clearEvents(self):
+        self.press_at = virtual_clock.now + responder.uniform(*key_rt_range)
+
+keyboard = types.SimpleNamespace(Keyboard = Keyboard)
+
+
+## window and stimuli
+class Window:
+    def __init__(self, *args, **kwargs):
+        self.monitorFramePeriod = 1.0 / frame_rate
+        self.frames = 0
+
+        self.on_flip = []
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self.on_flip.append((function, args, kwargs))
+
+    def flip(self, *args, **kwargs):
+        virtual_clock.advance(self.monitorFramePeriod)
+        self.frames += 1
+        on_flip, self.on_flip = self.on_flip, []
+        for function, function_args, function_kwargs in on_flip:
+            function(*function_args, **function_kwargs)
+        return virtual_clock.now
+
+    def clearBuffer(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class Stim:
+    def __init__(self, win = None, *args, **kwargs):
+        self.win = win
+        self.__dict__.update(kwargs)
+        self._texID = 0
+
+    def draw(self, *args, **kwargs):
+        pass
+
+
+class MovieStim(Stim):
+    isFinished = False
+
+    def play(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def seek(self, t):
+        pass
+
+    def unload(self):
+        pass
+
+
+class Slider(Stim):
+    # the synthetic participant clicks a random point on the scale a random time after it is first drawn
+    def __init__(self, win = None, *args, **kwargs):
+        super().__init__(win, *args, **kwargs)
+        self.marker = Stim(win)
+        self.validArea = Stim(win)
+        self.readOnly = False
+        self.rating = None
+        self.respond_at = None
+
+    def draw(self, *args, **kwargs):
+        if self.rating is None and not self.readOnly:
+            if self.respond_at is None:
+                self.respond_at = virtual_clock.now + responder.uniform(*rating_rt_range)
+            elif virtual_clock.now >= self.respond_at:
+                self.rating = round(responder.uniform(0, 100), 1)
+
+    def getRating(self):
+        return self.rating
+
+    def reset(self):
+        self.rating = None
+        self.respond_at = None
+        self.readOnly = False
+
+visual = types.SimpleNamespace(Window = Window,
+                               TextStim = Stim,
+                               Rect = Stim,
+                               ImageStim = Stim,
+                               MovieStim = MovieStim,
+                               Slider = Slider)
+
+
+## simulated parallel port: records every write against the virtual clock
+class ParallelPort:
+    def __init__(self, address = None):
+        self.address = address
+        self.value = 0
+        self.writes = []
+
+    def setData(self, value):
+        self.value = value
+        self.writes.append((virtual_clock.now, value))
+
+parallel = types.SimpleNamespace(ParallelPort = ParallelPort)
+gui = None
+prefs = None
+
+
+## webcam: a camera that delivers a blank frame at 30 fps (in real time, so capture threads don't spin)
+class Frame(bytearray):
+    # a blank BGR image buffer, so frames can be copied like the numpy arrays cv2 returns
+    shape = (480, 640, 3)
+    ctypes = types.SimpleNamespace(data = 0)
+
+    def __init__(self):
+        super().__init__(self.shape[0] * self.shape[1] * self.shape[2])
+
+class VideoCapture:
+    def __init__(self, index = 0):
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        return self.opened
+
+    def read(self, image = None):
+        time.sleep(1 / 30)
+        return self.opened, image if image is not None else Frame()
+
+    def release(self):
+        self.opened = False
+
+cv2 = types.SimpleNamespace(VideoCapture = VideoCapture)
+
+
+## OpenGL and PIL: uploads and image construction become no-ops
+class NoOpModule:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+GL = NoOpModule()
+Image = NoOpModule()
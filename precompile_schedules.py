@@ -0,0 +1,42 @@
+# Precompile LI1 schedules for a range of participant IDs into schedules.json, which LI1.py loads at startup.
+# Block orders are handed out in turn to each successive set of 6 PIDs (one full group x counterbalance cycle),
+# so every block order appears once in every group/cb cell before any is repeated.
+#
+# e.g. python precompile_schedules.py 1 60 --block-orders "0 1 2 3" "1 0 3 2" "2 3 0 1" "3 2 1 0"
+import argparse
+import os
+
+from schedule import Schedule, extinction_stim_blocks, cache_entry, check_schedule, load_schedule_cache, save_schedule_cache
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+default_cache_filepath = os.path.join(script_directory, "schedules.json")
+
+parser = argparse.ArgumentParser(description="Precompile LI1 participant schedules")
+parser.add_argument("first_pid", type=int)
+parser.add_argument("last_pid", type=int)
+parser.add_argument("--block-orders", nargs="+", default=["0 1 2 3"],
+                    help="block orders, each a space separated list of 4 block indices")
+parser.add_argument("--cache", default=default_cache_filepath, help="schedule cache file to create or update")
+args = parser.parse_args()
+
+block_orders = [[int(block) for block in block_order.split()] for block_order in args.block_orders]
+for block_order in block_orders:
+    if sorted(block_order) != list(range(len(extinction_stim_blocks))):
+        parser.error(f"block order {block_order} is not a permutation of 0-{len(extinction_stim_blocks) - 1}")
+
+cache = load_schedule_cache(args.cache)
+num_problems = 0
+print("PID\tgroup\tcb\tgroupname\tblock order\ttrials")
+for pid in range(args.first_pid, args.last_pid + 1):
+    block_order = block_orders[(pid - 1) // 6 % len(block_orders)]
+    entry = cache_entry(pid, block_order)
+    cache[str(pid)] = entry
+    
+    schedule = Schedule.from_dict(entry["schedule"])
+    print(f"{pid}\t{entry['group']}\t{entry['cb']}\t{entry['groupname']}\t{' '.join(map(str, block_order))}\t{len(schedule)}")
+    for problem in check_schedule(schedule):
+        print(f"  PID {pid}: {problem}")
+        num_problems += 1
+
+save_schedule_cache(cache, args.cache)
+print(f"Saved {args.last_pid - args.first_pid + 1} schedules to {args.cache} ({num_problems} problems found)")
@@ -0,0 +1,228 @@
+# Trial schedule compiler for LI1
+# Builds the trial sequence for a group and block order into a compact columnar structure: one list per field,
+# plus (start, stop) offsets for each phase and block so phase/block iteration is a single slice.
+# Compiled schedules can be saved to and reloaded from JSON.
+import json
+import random
+
+schedule_fields = ["phase", "blocknum", "stimulus", "outcome", "trialname", "trialnum"]
+response_fields = ["exp_response", "pain_response", "iti"]
+
+# familiarisation trials
+num_familiarisation = 15
+
+#pre-exposure trials
+num_TENS_preexp = 16
+
+#### 4 x blocks (4x fixed pseudo-randomised runs of 4x TENs and 4x no-TENS)
+num_blocks_conditioning = 2
+num_blocks_extinction = 2
+
+socialmodel_stim_blocks = [['control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'TENS', 'control','control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control'],
+                           ['TENS', 'TENS', 'TENS', 'control', 'TENS', 'control', 'TENS', 'control','control', 'TENS', 'control', 'TENS', 'control', 'control', 'TENS', 'control']]
+
+socialmodel_outcome_blocks = [['low','high','low','low','high','high','high','low','low','high','high','low','low','high','high','low'],
+                              ['high','high','high','low','high','low','high','low','low','high','low','high','low','low','high','low']]
+
+extinction_stim_blocks = [['control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'TENS', 'control'],
+                            ['control', 'TENS', 'control', 'TENS', 'control', 'control', 'TENS', 'control', 'TENS', 'TENS', 'TENS', 'control', 'TENS', 'control', 'TENS', 'control'],
+                            ['TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'control', 'TENS'],
+                            ['TENS', 'control', 'TENS', 'control', 'TENS', 'TENS', 'control', 'TENS', 'control', 'control', 'control', 'TENS', 'control', 'TENS', 'control', 'TENS']]
+
+#natural history has non-contingent pairings between high-low outcomes and stimuli, so we'll change the stimuli block
+# and keep the outcome blocks the same since the outcome order is pre-programmed on the CHEPS
+naturalhistory_stim_blocks = [['TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control'],
+                              ['TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control'],
+                              ['control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'control', 'control', 'TENS', 'TENS'],
+                              ['control', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS', 'TENS', 'control', 'control', 'TENS']]
+
+##need a different list to allocate high and low heat outcomes to TENS/control trials
+#0 = TENS high, 1 = TENS low, 2 = control high, 3 = control low
+#conditioning pairs TENS with high outcome (nocebo), and control with low outcome
+naturalhistory_outcome_blocks = [['low','high','high','low','low','high','high','low','low','high','low','low','high','high','high','low'],
+                               ['low','high','low','high','low','low','high','low','high','high','high','low','high','low','high','low'],
+                               ['low','low','high','high','high','low','low','high','high','low','high','high','low','low','low','high'],
+                               ['high','low','high','low','low','high','low','high','low','low','high','high','low','high','low','high']]
+
+#low heat for every trial in extinction regardless of stimulus
+extinction_outcome_block = ['low']*16
+
+
+class Schedule:
+    def __init__(self, columns, phase_offsets, block_offsets, groupname = None, block_order = None):
+        self.columns = columns # field -> list with one entry per trial
+        self.phase_offsets = phase_offsets # phase -> (start, stop) trial index range
+        self.block_offsets = block_offsets # blocknum -> (start, stop) trial index range
+        self.groupname = groupname
+        self.block_order = block_order
+
+    def __len__(self):
+        return len(self.columns["trialnum"])
+
+    def phase(self, phase):
+        return slice(*self.phase_offsets.get(phase, (0, 0)))
+
+    def block(self, blocknum):
+        return slice(*self.block_offsets.get(blocknum, (0, 0)))
+
+    def trials(self):
+        # expand into the per-trial dicts show_trial fills in, with empty response fields
+        trials = []
+        for index in range(len(self)):
+            trial = {field: column[index] for field, column in self.columns.items()}
+            trial.update({field: None for field in response_fields})
+            trials.append(trial)
+        return trials
+
+    def add_sm_ratings(self, means, spreads, seed = None, match_block_means = False, rating_range = (0, 100)):
+        # Pre-generate the social model's pain rating for every conditioning trial as an "sm_rating" column.
+        # Ratings are drawn per block and stimulus from a normal distribution truncated to the slider range,
+        # seeded so a session can be reproduced, and optionally shifted so each block hits the target means.
+        rng = random.Random(seed)
+        ratings = [None] * len(self)
+        for blocknum, (start, stop) in self.block_offsets.items():
+            if self.columns["phase"][start] != "conditioning":
+                continue
+            for stimulus in means:
+                indexes = [index for index in range(start, stop) if self.columns["stimulus"][index] == stimulus]
+                values = [truncated_normal(rng, means[stimulus], spreads[stimulus], *rating_range) for index in indexes]
+                if match_block_means and values:
+                    values = shift_to_mean(values, means[stimulus], *rating_range)
+                for index, value in zip(indexes, values):
+                    ratings[index] = value
+        self.columns["sm_rating"] = ratings
+
+    def to_dict(self):
+        return {"groupname": self.groupname,
+                "block_order": self.block_order,
+                "columns": self.columns,
+                "phase_offsets": self.phase_offsets,
+                "block_offsets": {str(blocknum): offsets for blocknum, offsets in self.block_offsets.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["columns"],
+                   {phase: tuple(offsets) for phase, offsets in data["phase_offsets"].items()},
+                   {int(blocknum): tuple(offsets) for blocknum, offsets in data["block_offsets"].items()},
+                   data.get("groupname"),
+                   data.get("block_order"))
+
+    def save(self, filepath):
+        with open(filepath, mode="w") as schedule_file:
+            json.dump(self.to_dict(), schedule_file)
+
+
+def truncated_normal(rng, mean, spread, low, high, max_draws = 1000):
+    # redraw until the value lands in range, so the result follows a truncated (not clipped) normal distribution;
+    # a mean and spread with almost nothing in range fall back to clipping the last draw after max_draws
+    for draw in range(max_draws):
+        value = rng.normalvariate(mean, spread)
+        if low <= value <= high:
+            return value
+    return min(high, max(low, value))
+
+
+def shift_to_mean(values, target, low, high, iterations = 20):
+    # shift all values by the same offset until their mean is the target, re-clipping to the range each time
+    for iteration in range(iterations):
+        offset = target - sum(values) / len(values)
+        if abs(offset) < 1e-6:
+            break
+        values = [min(high, max(low, value + offset)) for value in values]
+    return values
+
+
+def load_schedule(filepath):
+    with open(filepath) as schedule_file:
+        return Schedule.from_dict(json.load(schedule_file))
+
+
+def compile_schedule(groupname, block_order):
+    columns = {field: [] for field in schedule_fields}
+    phase_offsets = {}
+    block_offsets = {}
+
+    def add_trials(phase, blocknum, stimuli, outcomes, trialname = None):
+        start = len(columns["trialnum"])
+        for stimulus, outcome in zip(stimuli, outcomes):
+            columns["phase"].append(phase)
+            columns["blocknum"].append(blocknum)
+            columns["stimulus"].append(stimulus)
+            columns["outcome"].append(outcome)
+            columns["trialname"].append(trialname if trialname is not None else str(stimulus) + "_" + str(outcome))
+            columns["trialnum"].append(len(columns["trialnum"]) + 1)
+        stop = len(columns["trialnum"])
+        phase_offsets[phase] = (phase_offsets.get(phase, (start, stop))[0], stop)
+        if blocknum is not None:
+            block_offsets[blocknum] = (start, stop)
+
+    add_trials("familiarisation", None, [None] * num_familiarisation, [None] * num_familiarisation, "familiarisation")
+    add_trials("preexposure", None, ["TENS"] * num_TENS_preexp, ["none"] * num_TENS_preexp, "preexposure")
+
+    ### create list of trials based on trial_block order, iterating through stimulus + outcome blocks in parallel
+        #create conditioning blocks, outcome dependent on natural history vs nocebo conditioning contingencies
+    for block in range(1, num_blocks_conditioning + 1):
+        if groupname != "naturalhistory":
+            add_trials("conditioning", block, socialmodel_stim_blocks[block-1], socialmodel_outcome_blocks[block-1])
+        else:
+            add_trials("conditioning", block, naturalhistory_stim_blocks[block_order[block-1]], naturalhistory_outcome_blocks[block_order[block-1]])
+
+    #create extinction trials, all outcomes same regardless of condition (low heat)
+    for block in range(num_blocks_conditioning + 1, num_blocks_conditioning + num_blocks_extinction + 1):
+        add_trials("extinction", block, extinction_stim_blocks[block_order[block-1]], extinction_outcome_block)
+
+    return Schedule(columns, phase_offsets, block_offsets, groupname, list(block_order))
+
+
+# Group == 1 == social modelling, Group == 2 == pre-exposure, Group == 3 == natural history
+# cb == 1 == TENS = GREEN, control = BLUE
+# cb == 2 == TENS = BLUE, control = GREEN
+group_allocation = {1: (1, 1, "socialmodel"),
+                    2: (2, 1, "preexposure"),
+                    3: (3, 1, "naturalhistory"),
+                    4: (1, 2, "socialmodel"),
+                    5: (2, 2, "preexposure"),
+                    0: (3, 2, "naturalhistory")}
+
+def assign_group(pid):
+    # (group, cb, groupname) for a participant ID
+    return group_allocation[int(pid) % 6]
+
+
+def check_schedule(schedule):
+    # design problems in a compiled schedule, empty if it is valid
+    problems = []
+    if sorted(schedule.block_order) != list(range(len(extinction_stim_blocks))):
+        problems.append(f"block order {schedule.block_order} is not a permutation of 0-{len(extinction_stim_blocks) - 1}")
+    for blocknum, (start, stop) in schedule.block_offsets.items():
+        stimuli = schedule.columns["stimulus"][start:stop]
+        if stimuli.count("TENS") != stimuli.count("control"):
+            problems.append(f"block {blocknum} has {stimuli.count('TENS')} TENS and {stimuli.count('control')} control trials")
+    if schedule.columns["trialnum"] != list(range(1, len(schedule) + 1)):
+        problems.append("trial numbers are not consecutive")
+    return problems
+
+
+# Precompiled schedule cache: PID -> group allocation, block order and compiled schedule,
+# built offline by precompile_schedules.py so LI1.py can start a session with a single lookup
+def save_schedule_cache(cache, filepath):
+    with open(filepath, mode="w") as cache_file:
+        json.dump(cache, cache_file)
+
+
+def load_schedule_cache(filepath):
+    try:
+        with open(filepath) as cache_file:
+            return json.load(cache_file)
+    except FileNotFoundError:
+        return {}
+
+
+def cache_entry(pid, block_order):
+    group, cb, groupname = assign_group(pid)
+    schedule = compile_schedule(groupname, block_order)
+    return {"group": group,
+            "cb": cb,
+            "groupname": groupname,
+            "block_order": list(block_order),
+            "schedule": schedule.to_dict()}
@@ -0,0 +1,87 @@
+# Smoke-test the LI1 protocol by running complete headless sessions (python LI1.py --headless) for many
+# PID/group/block-order combinations in parallel, then checking every session saved a full set of responses.
+#
+# e.g. python simulate_sessions.py 1 120 --block-orders "0 1 2 3" "1 0 3 2" "2 3 0 1" "3 2 1 0"
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from schedule import assign_group, compile_schedule
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+
+parser = argparse.ArgumentParser(description="Run simulated LI1 sessions")
+parser.add_argument("first_pid", type=int)
+parser.add_argument("last_pid", type=int)
+parser.add_argument("--block-orders", nargs="+", default=["0 1 2 3"],
+                    help="block orders to run every PID with, each a space separated list of 4 block indices")
+parser.add_argument("--frame-rate", type=float, default=60, help="virtual refresh rate (lower runs faster)")
+parser.add_argument("--workers", type=int, default=os.cpu_count(), help="sessions run at once")
+parser.add_argument("--data-folder", help="keep session data here instead of a temporary folder")
+args = parser.parse_args()
+
+block_orders = [[int(block) for block in block_order.split()] for block_order in args.block_orders]
+
+
+def run_session(pid, block_order, data_folder):
+    session_folder = os.path.join(data_folder, f"{pid}_{''.join(map(str, block_order))}")
+    command = [sys.executable, os.path.join(script_directory, "LI1.py"), "--headless",
+               "--pid", str(pid),
+               "--block-order", *map(str, block_order),
+               "--data-folder", session_folder,
+               "--seed", str(pid),
+               "--frame-rate", str(args.frame_rate)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        error_lines = result.stderr.strip().splitlines()
+        return [f"exited with code {result.returncode}" + (f": {error_lines[-1]}" if error_lines else "")]
+
+    # every scheduled trial should be saved, in order, with a pain rating
+    problems = []
+    groupname = assign_group(pid)[2]
+    expected = compile_schedule(groupname, block_order).trials()
+    with open(os.path.join(session_folder, f"{pid}_responses.csv"), newline="") as csv_file:
+        saved = list(csv.DictReader(csv_file))
+    if len(saved) != len(expected):
+        problems.append(f"saved {len(saved)} of {len(expected)} trials")
+    for saved_trial, expected_trial in zip(saved, expected):
+        if saved_trial["trialname"] != expected_trial["trialname"]:
+            problems.append(f"trial {saved_trial['trialnum']} is {saved_trial['trialname']}, expected {expected_trial['trialname']}")
+            break
+    missing = [trial["trialnum"] for trial in saved if trial["pain_response"] == "" and trial["phase"] != "preexposure"]
+    if missing:
+        problems.append(f"no pain rating saved for trials {', '.join(missing)}")
+
+    # trials that run the TENS pulser: standard trials (all of natural history's, everyone's extinction)
+    # and the pre-exposure group's pre-exposure trials
+    unpulsed = [trial["trialnum"] for trial in saved
+                if (trial["phase"] == "extinction"
+                    or (groupname == "naturalhistory" and trial["phase"] == "conditioning")
+                    or (groupname == "preexposure" and trial["phase"] == "preexposure"))
+                and int(trial["tens_pulse_edges"] or 0) < 2]
+    if unpulsed:
+        problems.append(f"no TENS pulses logged for trials {', '.join(unpulsed)}")
+    return problems
+
+
+with tempfile.TemporaryDirectory() as temp_folder:
+    data_folder = args.data_folder if args.data_folder is not None else temp_folder
+    sessions = [(pid, block_order) for pid in range(args.first_pid, args.last_pid + 1) for block_order in block_orders]
+
+    run_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda session: run_session(*session, data_folder), sessions))
+
+    num_failed = 0
+    for (pid, block_order), problems in zip(sessions, results):
+        for problem in problems:
+            print(f"PID {pid} ({assign_group(pid)[2]}, block order {' '.join(map(str, block_order))}): {problem}")
+        num_failed += bool(problems)
+    print(f"{len(sessions) - num_failed}/{len(sessions)} sessions passed in {time.perf_counter() - run_start:.1f} s")
+
+sys.exit(1 if num_failed else 0)
@@ -1,8 +1,10 @@
 # Import packages
 from psychopy import core, event, gui, visual, parallel, prefs
+import time
 import math
 import csv
 import os
+import threading
 
 ports_live = None # Set to None if parallel ports not plugged for coding/debugging other parts of exp
 
@@ -66,6 +68,7 @@ if not os.path.exists(data_folder):
     
 #set file name within "data" folder
 data_filepath = os.path.join(data_folder,data_filename)
+pulse_log_filepath = os.path.join(data_folder, "tens_pulses.csv")
 
 if os.path.exists(data_filepath):
     print(f"Data already exists. Choose a different participant ID.") ### to avoid re-writing existing data
@@ -93,6 +96,82 @@ if ports_live == True:
 elif ports_live == None:
     pport = None #Get from device Manager
 
+# TENS pulse scheduler: a dedicated thread that drives pport.setData at exact TENS_pulse_int edges
+# (on for one interval, off for the next), so pulse timing no longer depends on the display frame rate.
+# Started and stopped by the trial code; every edge is logged with its intended and actual time.
+pulse_spin_time = 0.001 # sleep until this close to an edge, then spin for sub-millisecond accuracy
+
+class TENSPulser:
+    def __init__(self, pulse_interval):
+        self.pulse_interval = pulse_interval
+        self.edge_log = [] # (trialnum, edge, port value, intended time, actual time), times from pulse start in s
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.trial_edges = 0
+        self.trial_max_lag = 0
+
+    def start(self, stimulus, trialnum = None, eda_duration = 0):
+        # eda_duration: seconds from pulse start during which on-pulses also carry eda_trig to mark TENS onset
+        self.stop()
+        self.stop_event.clear()
+        self.trial_edges = 0
+        self.trial_max_lag = 0
+        self.thread = threading.Thread(target=self.pulse_loop,
+                                       args=(stimulus, trialnum, eda_duration),
+                                       name="tens_pulser",
+                                       daemon=True)
+        self.thread.start()
+
+    def pulse_loop(self, stimulus, trialnum, eda_duration):
+        start_time = time.perf_counter()
+        edge = 0
+        while True:
+            intended = start_time + edge * self.pulse_interval
+            remaining = intended - time.perf_counter()
+            if remaining > pulse_spin_time and self.stop_event.wait(remaining - pulse_spin_time):
+                break
+            while time.perf_counter() < intended:
+                pass
+            if self.stop_event.is_set():
+                break
+            
+            if edge % 2 == 0:
+                value = tens_trig[stimulus] + (eda_trig if edge * self.pulse_interval < eda_duration else 0)
+            else:
+                value = 0
+            if pport != None:
+                pport.setData(value)
+            actual = time.perf_counter()
+            
+            self.edge_log.append((trialnum, edge, value, intended - start_time, actual - start_time))
+            self.trial_edges += 1
+            self.trial_max_lag = max(self.trial_max_lag, actual - intended)
+            edge += 1
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        if pport != None:
+            pport.setData(0)
+
+    def pop_trial_stats(self):
+        # edges delivered and worst lag behind the intended edge time since the last call
+        stats = (self.trial_edges, self.trial_max_lag)
+        self.trial_edges = 0
+        self.trial_max_lag = 0
+        return stats
+
+    def save_log(self, filepath):
+        with open(filepath, mode="w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["trialnum", "edge", "value", "intended_time", "actual_time"])
+            writer.writerows(self.edge_log)
+
+tens_pulser = TENSPulser(TENS_pulse_int)
+
 #create instruction trials
 def instruction_trial(instructions,
                       waittime=0): 
@@ -123,10 +202,12 @@ def exit_screen(instructions):
 def termination_check(): #insert throughout experiment so participants can end at any point.
     keys_pressed = event.getKeys(keyList=["escape"])  # Check for "escape" key during countdown
     if "escape" in keys_pressed:
+        tens_pulser.stop()
         if ports_live:
             pport.setData(0) # Set all pins to 0 to shut off context, TENS, shock etc.
-        # Save participant information
-        save_data(trial_order)
+        # Save participant information (completed trials are already on disk)
+        close_data_file()
+        tens_pulser.save_log(pulse_log_filepath)
         core.quit()
 
 
@@ -230,27 +311,45 @@ cue_stims = {"TENS" : visual.Rect(win,
                         autoLog = False)
              }
 # Create functions
-    # Save responses to a CSV file
-def save_data(data):
-    for trial in trial_order:
-        trial['experimentcode'] = experimentcode
-        trial["tens_colour"] = stim_colour_names["TENS"]
-        trial["control_colour"] = stim_colour_names["control"]
-        
-
-    # Extract column names from the keys in the first trial dictionary
-    colnames = list(trial_order[0].keys())
-
-    # Open the CSV file for writing
-    with open(data_filepath, mode="w", newline="") as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=colnames)
-        
-        # Write the header row
-        writer.writeheader()
-        
-        # Write each trial"s data to the CSV file
-        for trial in data:
-            writer.writerow(trial)
+    # Save responses to a CSV file, one row appended per completed trial
+data_colnames = ["phase", "blocknum", "stimulus", "outcome", "trialname", "exp_response", "pain_response", "iti",
+                 "tens_pulse_edges", "tens_pulse_max_lag",
+                 "experimentcode", "tens_colour", "control_colour"]
+data_fsync = True # fsync after every row so a crash or escape press loses at most the trial in progress
+data_file = None
+
+def stamp_trial(trial):
+    trial['experimentcode'] = experimentcode
+    trial["tens_colour"] = stim_colour_names["TENS"]
+    trial["control_colour"] = stim_colour_names["control"]
+
+def flush_data_file():
+    data_file.flush()
+    if data_fsync:
+        os.fsync(data_file.fileno())
+
+def open_data_file():
+    global data_file, data_writer
+    # Open the CSV file for writing and write the header row once
+    data_file = open(data_filepath, mode="w", newline="")
+    data_writer = csv.DictWriter(data_file, fieldnames=data_colnames, extrasaction="ignore")
+    data_writer.writeheader()
+    flush_data_file()
+
+def save_trial(trial):
+    # Append a single trial's data to the CSV file, constant cost regardless of how many trials have run
+    if data_file is None:
+        return
+    stamp_trial(trial)
+    data_writer.writerow(trial)
+    flush_data_file()
+
+def close_data_file():
+    global data_file
+    if data_file is not None:
+        flush_data_file()
+        data_file.close()
+        data_file = None
     
 
 def show_trial(current_trial):
@@ -270,37 +369,17 @@ def show_trial(current_trial):
         countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
         win.flip()
     
-        TENS_timer = countdown_timer.getTime() + TENS_pulse_int
+    # turn on TENS pulses if TENS trial, at an on/off interval speed of TENS_pulse_int
+    tens_pulser.start(current_trial["stimulus"])
         
     while countdown_timer.getTime() < 8 and countdown_timer.getTime() > 7: #turn on TENS at 8 seconds
         termination_check()
-        
-        if pport != None:
-            # turn on TENS pulses if TENS trial, at an on/off interval speed of TENS_pulse_int
-            if countdown_timer.getTime() < TENS_timer - TENS_pulse_int:
-                pport.setData(tens_trig[current_trial["stimulus"]])
-            if countdown_timer.getTime() < TENS_timer - TENS_pulse_int*2:
-                pport.setData(0)
-                TENS_timer = countdown_timer.getTime() 
-
         countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
         cue_stims[current_trial["stimulus"]].draw()
         win.flip()
 
-    
-    TENS_timer = countdown_timer.getTime() + TENS_pulse_int
-
     while countdown_timer.getTime() < 7 and countdown_timer.getTime() > 0: #ask for expectancy at 7 seconds
-        if pport != None:
-            termination_check()
-                    
-            # turn on TENS pulses if TENS trial, at an on/off interval speed of TENS_pulse_int
-            if countdown_timer.getTime() < TENS_timer - TENS_pulse_int:
-                pport.setData(tens_trig[current_trial["stimulus"]])
-            if countdown_timer.getTime() < TENS_timer - TENS_pulse_int*2:
-                pport.setData(0)
-                TENS_timer = countdown_timer.getTime() 
-
+        termination_check()
         countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
         cue_stims[current_trial["stimulus"]].draw()
         
@@ -309,6 +388,7 @@ def show_trial(current_trial):
         exp_rating.draw()
         win.flip()    
 
+    tens_pulser.stop()
     current_trial["exp_response"] = exp_rating.getRating() #saves the expectancy response for that trial
     exp_rating.reset() #resets the expectancy slider for subsequent trials
             
@@ -338,7 +418,11 @@ def show_trial(current_trial):
     win.flip()
     core.wait(iti)
     current_trial["iti"] = iti
+    current_trial["tens_pulse_edges"], current_trial["tens_pulse_max_lag"] = tens_pulser.pop_trial_stats()
+    save_trial(current_trial)
     
+open_data_file()
+
 exp_finish = None        
 lastblocknum = None
 
@@ -359,8 +443,9 @@ while not exp_finish:
         lastblocknum = current_blocknum
     
     instruction_trial("Wait for Cosette to come back in.",10)
-    # save trial data
-    save_data(trial_order)
+    # close trial data file
+    close_data_file()
+    tens_pulser.save_log(pulse_log_filepath)
     
     exp_finish = True
     
@@ -0,0 +1,117 @@
+# Live session telemetry for LI1: a localhost asyncio server, run on its own thread, that streams experiment events
+# (trial start/end, phase changes, ratings, port transitions, frame stats) to any connected experimenter consoles
+# as newline-delimited JSON. Tail it with `python watch_session.py`.
+#
+# publish() is safe to call from any thread and never blocks: events go into a bounded buffer that the server thread
+# drains, and each client has its own bounded queue, so a slow or disconnected console only ever loses its own
+# oldest events and can't hold up the experiment.
+import asyncio
+import collections
+import json
+import threading
+import time
+
+
+class TelemetryServer:
+    def __init__(self, host = "127.0.0.1", port = 8765, buffer_size = 1024, client_buffer_size = 256):
+        self.host = host
+        self.port = port
+        self.pending = collections.deque(maxlen=buffer_size) # events published but not yet sent to the clients
+        self.client_buffer_size = client_buffer_size
+        self.clients = set() # one asyncio.Queue of encoded lines per connected client
+        self.state = {} # latest value of every field, sent to clients when they connect
+        self.loop = None
+        self.wake_scheduled = False
+        self.started = threading.Event()
+        self.events_published = 0
+        self.events_dropped = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.thread.start()
+        self.started.wait(timeout=2)
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            server = self.loop.run_until_complete(asyncio.start_server(self.handle_client, self.host, self.port))
+        except OSError as error:
+            print(f"Telemetry server could not listen on {self.host}:{self.port}: {error}")
+            self.loop = None
+            self.started.set()
+            return
+        print(f"Telemetry server listening on {self.host}:{self.port}")
+        self.started.set()
+        self.loop.run_forever()
+        server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.run_until_complete(server.wait_closed())
+        loop, self.loop = self.loop, None
+        loop.close()
+
+    def publish(self, event, **fields):
+        if self.loop is None:
+            return
+        fields["event"] = event
+        fields["time"] = time.time()
+        if len(self.pending) == self.pending.maxlen:
+            self.events_dropped += 1
+        self.pending.append(fields) # deque appends are thread safe, and a full deque discards its oldest event
+        self.events_published += 1
+        if not self.wake_scheduled:
+            self.wake_scheduled = True
+            try:
+                self.loop.call_soon_threadsafe(self.flush)
+            except RuntimeError: # loop already closed at exit
+                pass
+
+    def flush(self):
+        # server thread: encode the pending events once and hand them to every client's queue
+        self.wake_scheduled = False
+        while self.pending:
+            fields = self.pending.popleft()
+            self.state.update(fields)
+            line = (json.dumps(fields, default=str) + "\n").encode()
+            for client in self.clients:
+                if client.full():
+                    client.get_nowait() # drop this client's oldest event rather than wait for it
+                client.put_nowait(line)
+
+    async def handle_client(self, reader, writer):
+        client = asyncio.Queue(maxsize=self.client_buffer_size)
+        self.clients.add(client)
+        try:
+            writer.write((json.dumps(dict(self.state, event="hello"), default=str) + "\n").encode())
+            while True:
+                writer.write(await client.get())
+                await writer.drain()
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def shutdown(self, timeout = 0.5):
+        # send what is still pending (giving clients up to timeout to take it), then stop the loop
+        self.flush()
+        deadline = self.loop.time() + timeout
+        while any(not client.empty() for client in self.clients) and self.loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        self.loop.stop()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        if self.loop is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+            except RuntimeError:
+                pass
+        self.thread.join(timeout=1)
+        self.thread = None
+        print(f"Telemetry events published: {self.events_published}, dropped: {self.events_dropped}")
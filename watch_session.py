@@ -0,0 +1,61 @@
+# Experimenter console: tail the live event stream of a running LI1 session (started with --telemetry-port)
+#
+# e.g. python watch_session.py              (localhost, default port)
+#      python watch_session.py --port 8766 --raw
+import argparse
+import asyncio
+import json
+import time
+
+parser = argparse.ArgumentParser(description="Follow a running LI1 session")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8765)
+parser.add_argument("--raw", action="store_true", help="print the JSON events as they arrive")
+parser.add_argument("--retry", type=float, default=1.0, help="seconds between connection attempts")
+args = parser.parse_args()
+
+# fields shown for each event type, in order
+event_fields = {"hello": ["PID", "groupname", "phase", "trialnum"],
+                "phase": ["phase"],
+                "trial_start": ["trialnum", "trialname", "blocknum"],
+                "rating": ["trialnum", "slider", "rating"],
+                "trial_end": ["trialnum", "exp_response", "pain_response", "frame_mean", "frame_max", "frames_dropped"],
+                "port": ["value", "write_latency"],
+                "session_end": ["trialnum"]}
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def format_event(fields):
+    event = fields.get("event", "")
+    names = event_fields.get(event, [name for name in fields if name not in ("event", "time")])
+    values = "  ".join(f"{name}={format_value(fields[name])}" for name in names if fields.get(name) is not None)
+    return f"{time.strftime('%H:%M:%S', time.localtime(fields.get('time', time.time())))}  {event:<12}{values}"
+
+
+async def watch():
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(args.host, args.port)
+        except OSError:
+            await asyncio.sleep(args.retry)
+            continue
+        print(f"Connected to {args.host}:{args.port}")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            fields = json.loads(line)
+            print(line.decode().rstrip() if args.raw else format_event(fields), flush=True)
+        writer.close()
+        print("Session disconnected, waiting for the next one")
+
+
+try:
+    asyncio.run(watch())
+except KeyboardInterrupt:
+    pass
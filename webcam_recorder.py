@@ -0,0 +1,149 @@
+# Participant webcam recording for LI1: frames from the webcam capture thread are copied into a ring of shared memory
+# slots and encoded by a separate process, which writes a compressed video plus a per-frame timestamp index
+# (session clock time of each frame's capture), so encoding never runs on the render or capture threads.
+#
+# Back-pressure: a frame is only recorded if a slot is free at once; otherwise the recording skips it (frames_dropped)
+# and the capture thread carries straight on, so display frames are never held up.
+# The encoder is this file run as a script (python webcam_recorder.py <shared memory> ...), not a multiprocessing
+# child: spawning one re-runs the parent's main script, and LI1.py runs the whole experiment at import.
+# Slot numbers go to the encoder on its stdin and come back on its stdout once encoded.
+import argparse
+import collections
+import csv
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+
+def attach_shared_memory(name):
+    # attach without this process's resource tracker taking ownership (and unlinking it when the encoder exits)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError: # python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix": # only posix registers shared memory with a tracker (which can't start on Windows)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def encode_frames(shm_name, frame_shape, fps, video_path, index_path):
+    # encoder process: write each slot named on stdin to the video and its timestamps to the index, then hand it back
+    import cv2
+    import numpy as np
+
+    shm = attach_shared_memory(shm_name)
+    height, width, channels = frame_shape
+    slot_size = height * width * channels
+    video = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    with open(index_path, mode="w", newline="") as index_file:
+        index_writer = csv.writer(index_file)
+        index_writer.writerow(["video_frame", "capture_frame", "session_time", "encode_time"])
+        video_frame = 0
+        for line in sys.stdin:
+            slot, capture_frame, session_time = line.split()
+            frame = np.ndarray(frame_shape, dtype=np.uint8, buffer=shm.buf, offset=int(slot)*slot_size)
+            encode_start = time.perf_counter()
+            video.write(frame)
+            encode_time = time.perf_counter() - encode_start
+            del frame # release the view of shared memory before the slot is reused
+            sys.stdout.write(slot + "\n")
+            sys.stdout.flush()
+            index_writer.writerow([video_frame, capture_frame, session_time, encode_time])
+            video_frame += 1
+    video.release()
+    shm.close()
+
+
+class WebcamRecorder:
+    def __init__(self, video_path, index_path, fps = 30, slot_count = 16):
+        self.video_path = video_path
+        self.index_path = index_path
+        self.fps = fps
+        self.slot_count = slot_count
+        self.shm = None
+        self.slot_size = None
+        self.frame_shape = None
+        self.process = None
+        self.free_slots = collections.deque() # slots free to copy into, returned by the encoder
+        self.reader_thread = None
+        self.lock = threading.Lock() # held by offer while it touches the pipe and shared memory, and by stop
+        self.stopped = False
+        self.frames_recorded = 0
+        self.frames_dropped = 0
+
+    def start(self, frame_shape):
+        # size the shared memory ring for the camera's frames and launch the encoder (frames are only recorded after this)
+        self.frame_shape = tuple(frame_shape)
+        self.slot_size = self.frame_shape[0] * self.frame_shape[1] * self.frame_shape[2]
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_size * self.slot_count)
+        self.free_slots.extend(range(self.slot_count))
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), self.shm.name,
+                                         "--frame-shape", *map(str, self.frame_shape),
+                                         "--fps", str(self.fps),
+                                         "--video", self.video_path,
+                                         "--index", self.index_path],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        self.reader_thread = threading.Thread(target=self.read_free_slots, name="webcam_recorder", daemon=True)
+        self.reader_thread.start()
+        print(f"Recording webcam to {self.video_path}")
+
+    def read_free_slots(self):
+        for line in self.process.stdout:
+            self.free_slots.append(int(line))
+
+    def offer(self, frame, session_time, capture_frame):
+        # called on the capture thread for every captured frame; only waits if stop() is running
+        with self.lock:
+            if self.stopped or self.process is None:
+                return
+            if tuple(frame.shape) != self.frame_shape or not self.free_slots:
+                self.frames_dropped += 1 # the encoder is behind: skip this frame in the recording only
+                return
+            slot = self.free_slots.popleft()
+            start = slot * self.slot_size
+            self.shm.buf[start:start + self.slot_size] = memoryview(frame).cast("B")
+            try:
+                self.process.stdin.write(f"{slot} {capture_frame} {session_time!r}\n")
+            except (OSError, ValueError): # encoder gone or pipe closed; keep displaying, stop recording
+                self.stopped = True
+                print("Webcam encoder stopped unexpectedly, recording ended")
+                return
+            self.frames_recorded += 1
+
+    def stop(self, timeout = 10):
+        # let the encoder finish the frames already sent, then free the shared memory
+        with self.lock: # after this no offer() can touch the pipe or the shared memory
+            self.stopped = True
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close() # end of frames
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f"Webcam encoder still busy after {timeout} s, stopping it")
+            self.process.kill()
+            self.process.wait()
+        self.reader_thread.join(timeout=1)
+        self.process = None
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+        print(f"Webcam frames recorded: {self.frames_recorded}, dropped from recording: {self.frames_dropped}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webcam encoder process for LI1 (started by WebcamRecorder)")
+    parser.add_argument("shm_name")
+    parser.add_argument("--frame-shape", type=int, nargs=3, required=True, help="height width channels")
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--video", required=True)
+    parser.add_argument("--index", required=True)
+    args = parser.parse_args()
+    encode_frames(args.shm_name, tuple(args.frame_shape), args.fps, args.video, args.index)